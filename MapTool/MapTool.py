@@ -4,15 +4,14 @@
 # Description: Connects core_functions.py with map_tool_gui.py to create map tool program
 #------------------------------------------------------------------------------------------
 
-import sys, webbrowser
+import sys, time, threading, webbrowser
+startTime = time.perf_counter()
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
 from PyQt5.QtGui import QStandardItem, QStandardItemModel
-from PyQt5.QtCore import QVariant, QUrl
+from PyQt5.QtCore import QVariant, QUrl, QObject, QThread, pyqtSignal, pyqtSlot
 from PyQt5.Qt import Qt
 
-import pandas as pd
-import geopandas as gpd
-import core_functions, map_tool_gui
+import core_functions, map_tool_gui, lazy_imports
 
 # ----------------------------------------
 # GUI event handler and related functions
@@ -29,7 +28,7 @@ def browseFile1():              # open file dialog to select text file
 
 def populateCB():               # populate the delimiter type combo box
     ui.delimiterCB.clear()      # clear all items from combo box
-    delimiters = ['colon', 'comma', 'pipe', 'semi-colon', 'space', 'tab']     # list of delimiter types
+    delimiters = ['auto', 'colon', 'comma', 'pipe', 'semi-colon', 'space', 'tab']     # list of delimiter types, auto detects delimiter of each file
     ui.delimiterCB.addItems(delimiters)     # add list to delimiter combo box
     ui.processPB.setEnabled(True)       # enable process data push button
 
@@ -53,7 +52,7 @@ def setAttributesLV(attributes): # add fields from files to list view
 
 def processData():              # read data into dataframes
     ui.statusbar.showMessage("Processing data...please wait.")
-    global files                # create global variable to store file names
+    global files, delimiter     # create global variables to store file names and delimiter
 
     if ui.delimiterCB.currentText() and ui.file1LE.text():
         delimiter = ui.delimiterCB.currentText()    # delimiter from combo box
@@ -66,7 +65,7 @@ def processData():              # read data into dataframes
 
         try:
             global dataframes, fields       # create global variables to store dataframes and fields
-            dataframes = core_functions.createDF(files, delimiter)  # call create dataframes from raw text files function
+            dataframes = core_functions.readHeaders(files, delimiter)   # read header and sample rows only, full files are loaded when tool runs
             fields = core_functions.getFields(dataframes)   # call get fields from dataframes function
 
             ui.dataGB.setEnabled(True)                      # enable data group box and combo boxes
@@ -75,7 +74,7 @@ def processData():              # read data into dataframes
             ui.valueCB.setEnabled(True)
             ui.stateLE.setEnabled(True)
 
-            place_types = ['City', 'County', 'State']       # list of place type options
+            place_types = ['City', 'County', 'State'] + list(core_functions.aggregations)   # list of place type options, including cities rolled up into counties or states
             ui.placeTypeCB.clear()                          # clear combo box
             ui.placeTypeCB.addItems(place_types)            # populate combo box with place types
 
@@ -110,9 +109,12 @@ def enableTool():
     ui.outputGB.setEnabled(True)            # enable output groupbox
     ui.runPB.setEnabled(True)               # enable run push button
 
-def saveShapefile():         # open new file dialog to save shapefile
-    fileName, _ = QFileDialog.getSaveFileName(mainWindow,"Save new shapefile as", "","Shapefile (*.shp)")
+def saveShapefile():         # open new file dialog to save shapefile or other spatial output format
+    formats = {"Shapefile (*.shp)": ".shp", "GeoPackage (*.gpkg)": ".gpkg", "FlatGeobuf (*.fgb)": ".fgb", "GeoParquet (*.parquet)": ".parquet"}     # dictionary of output formats and extensions
+    fileName, selectedFilter = QFileDialog.getSaveFileName(mainWindow,"Save new shapefile as", "",";;".join(formats))
     if fileName:
+        if not fileName.lower().endswith(formats[selectedFilter]):     # add extension of selected format if missing
+            fileName += formats[selectedFilter]
         ui.shapefileLE.setText(fileName)
 
 def saveHtmlFile():         # open new file dialog to save html file
@@ -124,7 +126,7 @@ def checkInputs():      # check for required inputs before running tool
     keys = []           # initialize local variables
     state = ''
 
-    if ui.placeTypeCB.currentText() != 'County':    # if place type is not county, check to make sure inputs have been provided
+    if ui.placeTypeCB.currentText() not in ('County', 'Cities by County'):    # if place type does not need state, check to make sure inputs have been provided
         if len(files) == 1:
             if ui.placeTypeCB.currentText() and ui.placeFieldCB.currentText() and ui.valueCB.currentText() and ui.shapefileLE.text() and ui.htmlFileLE.text():
                 run(keys, state)
@@ -137,7 +139,7 @@ def checkInputs():      # check for required inputs before running tool
             else:
                 QMessageBox.information(mainWindow, 'Missing required input(s)', 'Please make sure that all required inputs have been specified.', QMessageBox.Ok)
 
-    else:                                           # if place type is county, check to make sure inputs have been provided
+    else:                                           # if place type is county or cities by county, check to make sure inputs have been provided
         if len(files) == 1:
             if ui.placeTypeCB.currentText() and ui.placeFieldCB.currentText() and ui.valueCB.currentText() and ui.stateLE.text() and ui.shapefileLE.text() and ui.htmlFileLE.text():
                 state = ui.stateLE.text()
@@ -181,39 +183,81 @@ def run(keys, state):      # call core functions to create geodataframe, shapefi
                 if ui.attributesLV.model().item(i).checkState() == Qt.Checked:
                     attributes.append(fields[2][i])
 
-        # set projections: WGS84 projection for geopanda and WKT for shapefile
-        crs4326 = {'init': 'epsg:4326'}
-        crs = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.01745329251994328,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
-
-        # merge dataframes and only keep desired attribute fields
-        merged_df = core_functions.mergeDataframes(dataframes, keys)
-        merged_df = merged_df[attributes]
-
-        # create geometry based on place type specified
-        createGeometry = {'City': core_functions.createPoints, 'County': core_functions.createPolygons, 'State': core_functions.createPolygons}
-        geometryList = merged_df.apply(createGeometry[place], place=place, column=placeField, state=state, axis=1)
-
-        # create geopanda with geometry and write data to shapefile
-        dataframeGeo = gpd.GeoDataFrame(merged_df, crs=crs4326, geometry=geometryList)
-        dataframeGeo.to_file(outShapefile, crs_wkt=crs)
-
-        # create folium map object from geodataframe, add features to map, and save as html file
-        core_functions.createMap(place, dataframeGeo, placeField, valueField, outHtml)
-
-        # display map in GUI by calling function
-        displayMap(outHtml)
-
-        ui.statusbar.showMessage("Success! Tool has created shapefile and map.")
+        # run tool on worker thread so window stays responsive and run can be cancelled
+        global thread, worker
+        thread = QThread()
+        worker = PipelineWorker(dict(files=files, delimiter=delimiter, keys=keys, place=place, placeField=placeField, valueField=valueField, attributes=attributes, state=state, outShapefile=outShapefile, outHtml=outHtml))
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.progress.connect(ui.statusbar.showMessage)
+        worker.finished.connect(runFinished)
+        worker.failed.connect(runFailed)
+        worker.cancelled.connect(runCancelled)
         ui.runPB.setEnabled(False)
+        thread.start()
 
     except Exception as e:
             QMessageBox.information(mainWindow, "Error", "Tool could not successfully run with " + str(e.__class__) + ": " + str(e), QMessageBox.Ok)
             ui.statusbar.clearMessage()
 
+class PipelineWorker(QObject):  # runs core functions on worker thread and reports progress with signals
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(dict, str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, inputs):
+        QObject.__init__(self)
+        self.inputs = inputs
+        self.cancelEvent = threading.Event()
+
+    @pyqtSlot()
+    def run(self):              # slot decorator makes run execute on worker thread
+        try:
+            stats = core_functions.runPipeline(progress=self.progress.emit, cancelEvent=self.cancelEvent, **self.inputs)
+        except core_functions.Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e.__class__) + ": " + str(e))
+        else:
+            self.finished.emit(stats, self.inputs['outHtml'])
+
+def stopThread():               # stop worker thread once run has ended
+    global worker
+    worker = None
+    thread.quit()
+    thread.wait()
+
+def runFinished(stats, outHtml):   # display map and summary when run succeeds
+    stopThread()
+    ui.runPB.setEnabled(True)
+    displayMap(outHtml)             # display map in GUI by calling function
+    ui.statusbar.showMessage(core_functions.runMessage(stats))
+
+def runFailed(message):         # show error message when run fails
+    stopThread()
+    ui.runPB.setEnabled(True)
+    QMessageBox.information(mainWindow, "Error", "Tool could not successfully run with " + message, QMessageBox.Ok)
+    ui.statusbar.clearMessage()
+
+def runCancelled():
+    stopThread()
+    ui.runPB.setEnabled(True)
+    ui.statusbar.showMessage("Run cancelled.")
+
+def cancel():                   # cancel running tool, or exit application if nothing is running
+    if worker is not None:
+        worker.cancelEvent.set()
+        ui.statusbar.showMessage("Cancelling...please wait.")
+    else:
+        app.quit()
+
 #------------------------------------------
 # Create app and main window
 #------------------------------------------
 app = QApplication(sys.argv)
+thread = None                   # worker thread and worker of current run
+worker = None
 
 # set up main window
 mainWindow = QMainWindow()
@@ -233,12 +277,20 @@ ui.attributesLV.clicked.connect(enableTool)
 ui.shapefileTB.clicked.connect(saveShapefile)
 ui.htmlFileTB.clicked.connect(saveHtmlFile)
 ui.runPB.clicked.connect(checkInputs)
-ui.cancelPB.clicked.connect(app.quit)
+ui.cancelPB.clicked.connect(cancel)
 
 #------------------------------------------
 # Run app
 #------------------------------------------
 mainWindow.show()
+
+# import heavy packages on background thread while user selects files, add --import-report to print import times
+def printImportReport():
+    print('Window shown after {:.3f} s'.format(shownTime - startTime))
+    print(lazy_imports.importReport())
+
+shownTime = time.perf_counter()
+lazy_imports.warmImports(['pandas', 'geopandas', 'shapely.geometry', 'folium', 'requests'], callback=printImportReport if '--import-report' in sys.argv else None)
 sys.exit(app.exec_())
 
 
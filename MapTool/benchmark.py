@@ -0,0 +1,171 @@
+# -----------------------------------------------------------------------------------------
+# Name: benchmark.py
+# Description: Benchmarks createDF, mergeDataframes, createGeometry and createMap on synthetic
+#              delimited files, geocoding offline with a generated gazetteer or the local stub
+#              server, and writes throughput, latency percentiles and peak memory to a JSON
+#              results file that later runs can be compared against
+#
+# Example:
+#   python benchmark.py --sizes 1000 100000 1000000 --delimiters comma tab --output results.json
+#   python benchmark.py --geocoder stub --delay 0.01 --compare results.json
+#------------------------------------------------------------------------------------------
+
+import os, sys, json, time, shutil, argparse, platform, tempfile, tracemalloc, urllib.parse
+import numpy as np
+import pandas as pd
+
+import core_functions
+import stub_server
+
+def createPlaces(count):                    # return names and coordinates of synthetic places, spread over the continental U.S.
+    random = np.random.RandomState(0)
+    names = ['Place{}'.format(i) for i in range(count)]
+    return names, random.uniform(-124.0, -67.0, count), random.uniform(25.0, 49.0, count)
+
+def writeGazetteer(path, names, lons, lats):   # write places as Census-style gazetteer file
+    pd.DataFrame({'USPS': 'MA', 'NAME': names, 'INTPTLAT': lats, 'INTPTLONG': lons}).to_csv(path, sep='\t', index=False)
+
+def writeData(folder, rows, width, delimiter, names):   # write two files joined by key field: places with values, and extra attribute fields
+    random = np.random.RandomState(rows)
+    sep = core_functions.delimiters[delimiter]
+    key = np.arange(rows)
+    first = pd.DataFrame({'key': key, 'city': np.array(names, dtype=object)[random.randint(0, len(names), rows)], 'value': random.randint(0, 100000, rows)})
+    second = pd.DataFrame({'key': random.permutation(key)})
+    for i in range(width):                  # alternate numeric and low-cardinality text fields
+        if i % 2:
+            second['label{}'.format(i)] = np.array(['class{}'.format(j) for j in range(20)], dtype=object)[random.randint(0, 20, rows)]
+        else:
+            second['measure{}'.format(i)] = random.uniform(0, 1000, rows).round(3)
+    paths = [os.path.join(folder, 'data_{}_{}_{}_{}.txt'.format(rows, width, delimiter, n)) for n in (1, 2)]
+    first.to_csv(paths[0], sep=sep, index=False)
+    second.to_csv(paths[1], sep=sep, index=False)
+    return paths
+
+def measure(func, repeat):                  # run func repeat times, return last result, run times and peak traced memory of one more run
+    seconds = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()                     # tracing slows code down, so memory is measured in a separate untimed run
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def summarize(name, rows, width, delimiter, seconds, peak, latencies = None):   # return result record with throughput and latency percentiles
+    record = {'benchmark': name, 'rows': rows, 'width': width, 'delimiter': delimiter, 'seconds': seconds,
+              'p50': float(np.percentile(seconds, 50)), 'p90': float(np.percentile(seconds, 90)), 'p99': float(np.percentile(seconds, 99)),
+              'rowsPerSecond': rows / float(np.median(seconds)) if np.median(seconds) else None, 'peakMemory': peak}
+    if latencies:                           # latency of single geocoding requests
+        record['requestP50'], record['requestP90'], record['requestP99'] = [float(value) for value in np.percentile(latencies, [50, 90, 99])]
+    return record
+
+def configure(args, folder, names, lons, lats):   # point geocoder at generated gazetteer or stub server and disable persistent caches, return server
+    core_functions.GEOCODE_CACHE_PATH = None
+    core_functions.PARSE_CACHE_DIR = None if not args.parse_cache else os.path.join(folder, 'parse_cache')
+    core_functions.BOUNDARY_STORE_PATH = None
+    core_functions.STAGE_CACHE = False
+    core_functions.FUZZY_MATCH = False
+    core_functions.GEOCODE_RATE_LIMIT = 0
+    core_functions.backend = None           # create backend selected below
+    if args.geocoder == 'gazetteer':
+        gazetteerPath = os.path.join(folder, 'gazetteer.txt')
+        writeGazetteer(gazetteerPath, names, lons, lats)
+        core_functions.GEOCODER_BACKEND = 'gazetteer'
+        core_functions.GAZETTEER_FILES = [(gazetteerPath, 'City')]
+        return None
+
+    server = stub_server.StubServer(0, delay=args.delay)
+    for name, lon, lat in zip(names, lons, lats):   # record a Nominatim response for every synthetic place
+        server.add('/search?' + urllib.parse.urlencode({'q': name, 'format': 'json', 'countrycodes': 'US', 'limit': 1}), [{'lat': str(lat), 'lon': str(lon), 'osm_id': 0, 'osm_type': 'node'}])
+    url = server.start()
+    core_functions.GEOCODER_BACKEND = 'nominatim'
+    core_functions.NOMINATIM_URL = url + '/search'
+    return server
+
+def run(args):                              # run benchmarks for every size, width and delimiter, return list of result records
+    folder = args.data_dir or tempfile.mkdtemp(prefix='maptool_benchmark_')
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    names, lons, lats = createPlaces(args.places)
+    server = configure(args, folder, names, lons, lats)
+
+    latencies = []
+    query = core_functions.queryNominatim
+    def timedQuery(*a, **kw):               # record latency of each geocoding request
+        start = time.perf_counter()
+        try:
+            return query(*a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    core_functions.queryNominatim = timedQuery
+
+    results = []
+    try:
+        for rows in args.sizes:
+            for width in args.widths:
+                for delimiter in args.delimiters:
+                    label = '{} rows, {} extra fields, {}'.format(rows, width, delimiter)
+                    print('Generating ' + label + '...')
+                    files = writeData(folder, rows, width, delimiter, names)
+
+                    dataframes, seconds, peak = measure(lambda: core_functions.createDF(files, delimiter), args.repeat)
+                    results.append(summarize('createDF', rows, width, delimiter, seconds, peak))
+                    merged, seconds, peak = measure(lambda: core_functions.mergeDataframes(dataframes, ['key', 'key']), args.repeat)
+                    results.append(summarize('mergeDataframes', rows, width, delimiter, seconds, peak))
+
+                    del latencies[:]
+                    geometry, seconds, peak = measure(lambda: core_functions.createGeometry(merged, 'City', 'city', ''), args.repeat)
+                    results.append(summarize('createGeometry', rows, width, delimiter, seconds, peak, latencies))
+
+                    gdf = core_functions.gpd.GeoDataFrame(merged, crs='epsg:4326', geometry=geometry)
+                    outHtml = os.path.join(folder, 'map_{}_{}_{}.html'.format(rows, width, delimiter))
+                    _, seconds, peak = measure(lambda: core_functions.createMap('City', gdf, 'city', 'value', outHtml), args.repeat)
+                    results.append(summarize('createMap', rows, width, delimiter, seconds, peak))
+                    for record in results[-4:]:
+                        print('  {:<16}{:>10.3f} s median{:>14.0f} rows/s{:>10.1f} MB peak'.format(record['benchmark'], record['p50'], record['rowsPerSecond'] or 0, record['peakMemory'] / 1048576.0))
+    finally:
+        core_functions.queryNominatim = query
+        if server is not None:
+            server.shutdown()
+        if not args.data_dir:               # remove generated files unless they were written to a folder given by user
+            shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+def compare(results, path):                 # print change of median time against results file of earlier run
+    with open(path) as f:
+        previous = dict(((r['benchmark'], r['rows'], r['width'], r['delimiter']), r) for r in json.load(f)['results'])
+    print('\nCompared with ' + path + ':')
+    for record in results:
+        old = previous.get((record['benchmark'], record['rows'], record['width'], record['delimiter']))
+        if old is not None and old['p50']:
+            print('  {:<16}{:>9} rows {:>3} fields {:<6}{:>+8.1f} %'.format(record['benchmark'], record['rows'], record['width'], record['delimiter'], (record['p50'] / old['p50'] - 1.0) * 100.0))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark map tool core functions on synthetic data, offline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help='numbers of rows')
+    parser.add_argument('--widths', type=int, nargs='+', default=[4], help='numbers of extra attribute fields')
+    parser.add_argument('--delimiters', nargs='+', default=['comma'], choices=sorted(core_functions.delimiters), help='delimiters of generated files')
+    parser.add_argument('--places', type=int, default=2000, help='number of distinct place names')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--geocoder', choices=['gazetteer', 'stub'], default='gazetteer', help='geocode with generated gazetteer or through stub server')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds stub server waits before each response')
+    parser.add_argument('--parse-cache', action='store_true', help='read files through parse cache')
+    parser.add_argument('--data-dir', help='keep generated files in this folder')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='results file')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    info = {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'geocoder': args.geocoder, 'delay': args.delay, 'repeat': args.repeat}
+    with open(args.output, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': info, 'results': results}, f, indent=2)
+    print('Wrote ' + args.output)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -----------------------------------------------------------------------------------------
+# Name: boundary_store.py
+# Description: Local SQLite store of county/state boundary geometries keyed by OSM relation ID,
+#              saved as WKB so polygon jobs do not have to download boundaries again
+#------------------------------------------------------------------------------------------
+
+import os, json, time, sqlite3, threading
+from lazy_imports import lazyImport
+from gazetteer import normalizeName, normalizeState
+
+wkb = lazyImport('shapely.wkb')
+shapelyGeometry = lazyImport('shapely.geometry')
+
+nameKeyVersion = 1                          # increase when makeNameKey changes so stored name keys are rebuilt
+
+def makeNameKey(place, name, state = ''):   # normalize place type, name and state into lookup key, e.g. "St. Louis County" and "saint louis" share a key
+    state = normalizeState(state) or ' '.join(str(state or '').lower().split()) if place == 'County' else ''
+    return '{}|{}|{}'.format(place.lower(), normalizeName(name, place), state)
+
+class BoundaryStore(object):
+    def __init__(self, path):               # open (or create) boundary database at path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self._geometries = {}               # geometries already loaded from database, by relation ID
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)   # wait for batch worker processes writing to same database
+        self._conn.execute('CREATE TABLE IF NOT EXISTS boundary (relation_id INTEGER PRIMARY KEY, wkb BLOB NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS boundary_name (name_key TEXT PRIMARY KEY, relation_id INTEGER NOT NULL, display_name TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS seed_file (path TEXT PRIMARY KEY, mtime REAL NOT NULL)')
+        if 'display_name' not in [row[1] for row in self._conn.execute('PRAGMA table_info(boundary_name)')]:   # store created before names were kept as given
+            self._conn.execute('ALTER TABLE boundary_name ADD COLUMN display_name TEXT')
+            self._conn.execute('DELETE FROM seed_file')    # load seed files and county prefetches again to fill in names
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < nameKeyVersion:   # names were stored with older key format, so seed files are loaded again
+            self._conn.execute('DELETE FROM boundary_name')
+            self._conn.execute('DELETE FROM seed_file')
+            self._conn.execute('PRAGMA user_version = {}'.format(nameKeyVersion))
+        self._conn.commit()
+
+    def get(self, relationID):              # return geometry for relation ID, loading WKB only when first requested
+        relationID = int(relationID)
+        with self._lock:
+            if relationID not in self._geometries:
+                row = self._conn.execute('SELECT wkb FROM boundary WHERE relation_id = ?', (relationID,)).fetchone()
+                if row is None:
+                    return None
+                self._geometries[relationID] = wkb.loads(bytes(row[0]))
+            return self._geometries[relationID]
+
+    def getByName(self, place, name, state = ''):  # return geometry stored for place name, or None
+        with self._lock:
+            row = self._conn.execute('SELECT relation_id FROM boundary_name WHERE name_key = ?', (makeNameKey(place, name, state),)).fetchone()
+        if row is None:
+            return None
+        return self.get(row[0])
+
+    def put(self, relationID, geometry, place = None, name = None, state = ''):   # save geometry and optional place name for relation ID
+        relationID = int(relationID)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO boundary (relation_id, wkb) VALUES (?, ?)', (relationID, wkb.dumps(geometry)))
+            if place and name:
+                self._conn.execute('INSERT OR REPLACE INTO boundary_name (name_key, relation_id, display_name) VALUES (?, ?, ?)', (makeNameKey(place, name, state), relationID, name))
+            self._conn.commit()
+            self._geometries[relationID] = geometry
+
+    def addName(self, relationID, place, name, state = ''):   # link another place name to a stored relation ID, keeping name it was first saved with
+        with self._lock:
+            self._conn.execute('INSERT INTO boundary_name (name_key, relation_id, display_name) VALUES (?, ?, ?) '
+                               'ON CONFLICT (name_key) DO UPDATE SET relation_id = excluded.relation_id, display_name = COALESCE(display_name, excluded.display_name)', (makeNameKey(place, name, state), int(relationID), name))
+            self._conn.commit()
+
+    def putMany(self, boundaries, place, state = '', source = None):   # save (relation ID, name, geometry) tuples in one transaction, recording source they came from
+        with self._lock:
+            count = self._putMany(boundaries, place, state)
+            if source:
+                self._conn.execute('INSERT OR REPLACE INTO seed_file (path, mtime) VALUES (?, ?)', (source, time.time()))
+            self._conn.commit()
+        return count
+
+    def _putMany(self, boundaries, place, state):  # save (relation ID, name, geometry) tuples without committing, caller holds lock
+        count = 0
+        for relationID, name, geometry in boundaries:
+            if geometry is None:
+                continue
+            relationID = int(relationID)
+            self._conn.execute('INSERT OR REPLACE INTO boundary (relation_id, wkb) VALUES (?, ?)', (relationID, wkb.dumps(geometry)))
+            if name:
+                self._conn.execute('INSERT OR REPLACE INTO boundary_name (name_key, relation_id, display_name) VALUES (?, ?, ?)', (makeNameKey(place, name, state), relationID, name))
+            self._geometries[relationID] = geometry
+            count += 1
+        return count
+
+    def sourceTime(self, source):           # return time boundaries from source were saved, or None if never
+        with self._lock:
+            row = self._conn.execute('SELECT mtime FROM seed_file WHERE path = ?', (source,)).fetchone()
+        return row[0] if row is not None else None
+
+    def names(self, place, state = ''):     # return normalized names stored for place type, for counties only those in state
+        prefix = makeNameKey(place, '', state).split('|')
+        with self._lock:
+            rows = self._conn.execute('SELECT name_key FROM boundary_name WHERE name_key LIKE ? AND name_key LIKE ?', (prefix[0] + '|%', '%|' + prefix[2])).fetchall()
+        return [row[0].split('|')[1] for row in rows if row[0].split('|')[2] == prefix[2]]
+
+    def boundaries(self, place, state = ''):   # return (relation ID, name, normalized name, geometry) of each stored boundary of place type, for counties only those in state
+        prefix = makeNameKey(place, '', state).split('|')
+        with self._lock:    # names as given first, names stored before they were kept only have normalized key
+            rows = self._conn.execute('SELECT name_key, relation_id, display_name FROM boundary_name WHERE name_key LIKE ? ORDER BY display_name IS NULL, name_key', (prefix[0] + '|%',)).fetchall()
+        relations = {}
+        for nameKey, relationID, name in rows:     # relations stored under several spellings are only returned once
+            parts = nameKey.split('|')
+            if parts[2] == prefix[2] and relationID not in relations:
+                relations[relationID] = (name or parts[1].title(), parts[1])
+        return [(relationID, name, key, self.get(relationID)) for relationID, (name, key) in relations.items()]
+
+    def seedFromGeoJSON(self, path, place, state = '', idProperty = 'osm_id', nameProperty = 'name'):   # load boundaries from local GeoJSON file
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            row = self._conn.execute('SELECT mtime FROM seed_file WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        if row is not None and row[0] == mtime:    # file was already loaded and has not changed since
+            return 0
+
+        with open(path) as f:
+            features = json.load(f)['features']
+        with self._lock:
+            lowest = self._conn.execute('SELECT MIN(relation_id) FROM boundary').fetchone()[0] or 0
+        nextID = min(lowest, 0) - 1
+        boundaries = {}                     # boundaries of each state, since putMany saves names under one state
+        for feature in features:
+            properties = feature.get('properties') or {}
+            relationID = properties.get(idProperty)
+            if relationID is None:          # features without relation ID get negative IDs so they cannot clash with OSM IDs
+                relationID = nextID
+                nextID -= 1
+            boundaries.setdefault(properties.get('state', state), []).append((relationID, properties.get(nameProperty), shapelyGeometry.shape(feature['geometry'])))
+
+        with self._lock:                    # save all boundaries and seed file record in one transaction
+            try:
+                for featureState, items in boundaries.items():
+                    self._putMany(items, place, featureState)
+                self._conn.execute('INSERT OR REPLACE INTO seed_file (path, mtime) VALUES (?, ?)', (os.path.abspath(path), mtime))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                self._geometries.clear()    # may hold geometries that were rolled back
+                raise
+        return sum(len(items) for items in boundaries.values())
+
+    def clear(self):                        # remove all stored boundaries
+        with self._lock:
+            self._conn.execute('DELETE FROM boundary')
+            self._conn.execute('DELETE FROM boundary_name')
+            self._conn.execute('DELETE FROM seed_file')
+            self._conn.commit()
+            self._geometries.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,90 +1,726 @@
 # import required packages and modules
-import os, urllib.parse, requests, geojson
-import numpy as np
-import pandas as pd
-from shapely.geometry import Point, shape, mapping
-import geopandas as gpd
-import folium
-
-def createDF(files, delimiter):             # create list of dataframes from raw text files
-    delimiters = {'colon': ':', 'comma': ',', 'pipe': '|', 'semi-colon': ';', 'space': ' ', 'tab':'\t'}     # dictionary of delimiter types
+import os, csv, json, time, hashlib, threading, importlib.util, urllib.parse
+from lazy_imports import lazyImport
+from instrumentation import count
+import geocoder, tiled_map, instrumentation
+from geocoder import Cancelled
+from geocode_cache import GeocodeCache
+from boundary_store import BoundaryStore
+from parse_cache import ParseCache
+from gazetteer import Gazetteer, states as stateNames, normalizeName, normalizeState, splitPlace
+
+# heavy packages are imported on first use so the GUI starts quickly
+pd = lazyImport('pandas')
+gpd = lazyImport('geopandas')
+fuzzy_match = lazyImport('fuzzy_match')
+folium = lazyImport('folium')
+foliumPlugins = lazyImport('folium.plugins')
+geojson = lazyImport('geojson')
+shapelyGeometry = lazyImport('shapely.geometry')
+shapely = lazyImport('shapely')
+np = lazyImport('numpy')
+
+#------------------------------*EDIT IF NEEDED*-------------------------------------------------
+# text file settings
+CSV_CHUNK_SIZE = 100000                     # number of rows parsed at a time when reading text files
+CSV_MEMORY_LIMIT = None                     # maximum bytes of memory a single loaded file may use, None for no limit
+
+# memory settings: while loading, numeric fields are always stored in the smallest dtype that holds their values, COMPACT_DATAFRAMES = False does not change that
+COMPACT_DATAFRAMES = True                   # also store text fields with few distinct values as categories, and report memory saved per field against parsed dtypes
+CATEGORY_MAX_RATIO = 0.5                    # maximum share of distinct values in a text field for storing it as categories
+
+# parse cache settings: set PARSE_CACHE_DIR to None to always parse text files (requires pyarrow)
+PARSE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.maptool', 'parse_cache')
+PARSE_CACHE_HASH = False                    # also compare file contents, not only size and modification time, before using cache
+
+# geocoding cache settings: set GEOCODE_CACHE_PATH to None to disable the cache
+GEOCODE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.maptool', 'geocode_cache.sqlite')
+GEOCODE_CACHE_TTL = 30 * 24 * 3600          # seconds before cached responses expire
+GEOCODE_CACHE_MAX_ENTRIES = 100000          # maximum number of cached responses
+
+# geocoder backend, a name registered in geocoder.backends: 'nominatim' queries web services, 'gazetteer' geocodes offline from GAZETTEER_FILES (points) and boundary store (polygons)
+GEOCODER_BACKEND = 'nominatim'
+GAZETTEER_FILES = []                        # delimited gazetteer files, as (path, place type) tuples, e.g. ('2020_Gaz_place_national.txt', 'City')
+
+# fuzzy matching of place names that could not be geocoded, against names in gazetteer (points) or boundary store (polygons)
+FUZZY_MATCH = True
+FUZZY_THRESHOLD = 0.8                       # minimum similarity (1 - edit distance / name length) to accept a match
+
+# geocoding request settings
+GEOCODE_RATE_LIMIT = 1.0                    # maximum requests per second to each web service (Nominatim usage policy is 1/s)
+GEOCODE_MAX_IN_FLIGHT = 4                   # maximum number of concurrent geocoding requests
+GEOCODE_RETRIES = 3                         # number of retries for failed or throttled requests
+GEOCODE_BACKOFF = 1.0                       # seconds before first retry, doubled for each further retry
+GEOCODE_TIMEOUT = 30                        # seconds before a request times out
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'   # point both URLs at stub_server.py to replay recorded responses
+OSM_POLYGON_URL = 'http://polygons.openstreetmap.fr/get_geojson.py'
+HTTP_USER_AGENT = 'MapTool (GEOG 489 map tool)'
+COUNTY_PREFETCH = True                      # for County maps, download all county boundaries of state with one Overpass query instead of two queries per county
+OVERPASS_URL = 'https://overpass-api.de/api/interpreter'
+
+# map output settings: simplification and coordinate precision only apply to map, shapefile keeps full resolution
+MAP_SIMPLIFY_PIXELS = 0.5                   # polygon simplification tolerance in screen pixels at starting zoom level, 0 to keep all vertices
+MAP_OUTPUT_MODE = 'auto'                    # 'single' writes one html file, 'tiled' writes tile folder and viewer, 'auto' picks tiled above threshold
+TILED_FEATURE_THRESHOLD = 50000             # number of features above which 'auto' mode writes a tiled map
+POINT_CLUSTER_THRESHOLD = 1000              # number of points above which points are drawn as one clustered data layer
+MAP_COORDINATE_DECIMALS = 5                 # decimal places kept for map coordinates (5 decimals is about 1 m), None to keep full precision
+
+# instrumentation settings: a JSON report of stage times, event counts and memory is written next to the map html file as <name>_report.json
+RUN_REPORT = True
+PROFILE_RUN = False                         # also profile run with cProfile and tracemalloc (slower), writing <name>_report.prof
+
+# stage cache settings: results of the last run are kept in memory and reused by the next run for stages whose inputs have not changed
+STAGE_CACHE = True
+
+# aggregation settings: how values of cities are combined for 'Cities by County' and 'Cities by State' place types
+AGGREGATE_FUNCTION = 'sum'                  # 'sum', 'mean' or 'count' of rows in each polygon
+
+# boundary store settings: set BOUNDARY_STORE_PATH to None to always download boundaries from OSM
+BOUNDARY_STORE_PATH = os.path.join(os.path.expanduser('~'), '.maptool', 'boundaries.sqlite')
+BOUNDARY_SEED_FILES = []                    # local GeoJSON files loaded into store, as (path, place type, state) tuples, e.g. ('counties.geojson', 'County', 'Ohio')
+#-----------------------------------------------------------------------------------------------
+
+aggregations = {'Cities by County': 'County', 'Cities by State': 'State'}    # place types that geocode cities and roll them up into polygons of this place type
+delimiters = {'colon': ':', 'comma': ',', 'pipe': '|', 'semi-colon': ';', 'space': ' ', 'tab':'\t'}     # dictionary of delimiter types
+geocodeCache = None
+parseCache = None
+gazetteer = None
+backend = None
+stageCache = {}                             # stage name -> (fingerprint of inputs, result, statistics, signature of output files) of last run
+openLock = threading.RLock()                # first use may happen on several geocoding threads at once, so shared objects are created under lock
+
+def getGeocodeCache():                      # open geocoding cache on first use
+    global geocodeCache
+    with openLock:
+        if geocodeCache is None and GEOCODE_CACHE_PATH:
+            geocodeCache = GeocodeCache(GEOCODE_CACHE_PATH, ttl=GEOCODE_CACHE_TTL, maxEntries=GEOCODE_CACHE_MAX_ENTRIES)
+    return geocodeCache
+
+boundaryStore = None
+
+def getBoundaryStore():                     # open boundary store on first use and load seed files
+    global boundaryStore
+    with openLock:
+        if boundaryStore is None and BOUNDARY_STORE_PATH:
+            store = BoundaryStore(BOUNDARY_STORE_PATH)
+            for path, place, state in BOUNDARY_SEED_FILES:
+                store.seedFromGeoJSON(path, place, state)
+            boundaryStore = store           # only share store once seed files are loaded
+    return boundaryStore
+
+def getGazetteer():                         # load gazetteer files into memory on first use
+    global gazetteer
+    with openLock:
+        if gazetteer is None:
+            places = Gazetteer()
+            for path, place in GAZETTEER_FILES:
+                places.load(path, place)
+            gazetteer = places              # only share gazetteer once files are loaded
+    return gazetteer
+
+def getCacheStats():                        # return hit/miss counters of geocoding cache since last resetCacheStats
+    cache = getGeocodeCache()
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'entries': 0}
+    return cache.stats()
+
+def resetCacheStats():                      # start counting cache hits and misses again, e.g. for each run
+    cache = getGeocodeCache()
+    if cache is not None:
+        cache.resetStats()
+
+def createDF(files, delimiter, usecols = None, chunksize = None, memoryLimit = None, parsedSizes = None):   # create list of dataframes from raw text files, appending {field: (dtype, bytes)} of numeric fields before downcasting for each file to parsedSizes
+    cache = getParseCache()
     dataframes = []
-    for file in files:                      # loop through files, create dataframe by reading file
-        name = 'df' + str(files.index(file))
-        name = pd.read_csv(file, sep=delimiters[delimiter], header=0)
-        dataframes.append(name)
+    for file in files:                      # loop through files, read dataframe from parse cache or by parsing file
+        fileDelimiter = sniffDelimiter(file) if delimiter == 'auto' else delimiter
+        sizes = {}
+        if parsedSizes is not None:
+            parsedSizes.append(sizes)
+        if cache is None:
+            df = readTextFile(file, fileDelimiter, usecols, chunksize, memoryLimit, sizes)
+            count('filesParsed')
+            dataframes.append(df)
+            continue
+
+        paths = cache.paths(file, fileDelimiter)    # key of cached version, computed once since it may hash whole file
+        storedColumns, header = cache.storedColumns(file, fileDelimiter, paths)
+        if header is None:                  # not cached, read field names so fields of other files in usecols are ignored
+            header = list(pd.read_csv(file, sep=delimiters[fileDelimiter], header=0, nrows=0).columns)
+        wanted = header if usecols is None else [field for field in header if field in set(usecols)]
+        missing = [field for field in wanted if field not in (storedColumns or [])]
+        count('parseCacheHits' if storedColumns is not None and not missing else 'filesParsed')
+        if storedColumns is not None:
+            sizes.update(cache.parsedSizes(file, fileDelimiter, paths))
+        if storedColumns is not None and not missing:
+            df = cache.load(file, fileDelimiter, wanted, paths)
+        else:                               # only parse fields not cached yet, and add them to cached fields so cache keeps growing towards whole file
+            df = readTextFile(file, fileDelimiter, None if missing == header else missing, chunksize, memoryLimit, sizes)
+            if storedColumns:
+                df = pd.concat([cache.load(file, fileDelimiter, storedColumns, paths), df], axis=1)
+            cache.save(file, fileDelimiter, df, header, paths, sizes)
+            df = df[wanted]
+        for field in [field for field in sizes if field not in df.columns]:     # only report fields that were loaded
+            del sizes[field]
+        dataframes.append(df)
+    return dataframes
+
+def readTextFile(file, delimiter, usecols = None, chunksize = None, memoryLimit = None, parsedSizes = None):   # parse text file in chunks into dataframe, recording {field: (dtype, bytes)} of numeric fields before downcasting in parsedSizes
+    chunksize = chunksize or CSV_CHUNK_SIZE
+    memoryLimit = memoryLimit or CSV_MEMORY_LIMIT
+    if usecols is not None:                 # only parse selected fields, ignoring fields the file does not contain
+        wanted = set(usecols)
+        usecols = lambda field: field in wanted
+    chunks = []
+    size = 0
+    for chunk in pd.read_csv(file, sep=delimiters[delimiter], header=0, usecols=usecols, chunksize=chunksize):
+        if parsedSizes is not None:         # numeric fields are downcast below, so compaction reports savings against parsed size
+            for field in chunk.columns:
+                if pd.api.types.is_numeric_dtype(chunk[field]):
+                    dtype, size = parsedSizes.get(field, (str(chunk[field].dtype), 0))
+                    parsedSizes[field] = (dtype, size + int(chunk[field].memory_usage(index=False)))
+        chunk = compactDataFrame(chunk)     # categories are only created once whole file is loaded, so chunks do not get different categories
+        size += chunk.memory_usage(deep=True).sum()
+        if memoryLimit and size > memoryLimit:  # stop reading before file uses more memory than allowed
+            raise MemoryError('{} needs more than {:.0f} MB of memory. Select fewer attribute fields or raise CSV_MEMORY_LIMIT.'.format(file, memoryLimit / 1048576.0))
+        chunks.append(chunk)
+    if not chunks:                          # file only has a header row
+        chunks.append(pd.read_csv(file, sep=delimiters[delimiter], header=0, usecols=usecols, nrows=0))
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+def sniffDelimiter(file, sampleSize = 65536):  # detect delimiter type from sample at start of file
+    with open(file, newline='') as f:
+        sample = f.read(sampleSize)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=''.join(delimiters.values()))
+    except csv.Error:                       # delimiter could not be detected, e.g. file has a single field
+        return 'comma'
+    return [name for name, character in delimiters.items() if character == dialect.delimiter][0]
+
+def readHeaders(files, delimiter, sampleRows = 100):   # create list of empty dataframes with fields and sample dtypes of each file, without loading files
+    dataframes = []
+    for file in files:
+        fileDelimiter = sniffDelimiter(file) if delimiter == 'auto' else delimiter
+        sample = pd.read_csv(file, sep=delimiters[fileDelimiter], header=0, nrows=sampleRows)
+        dataframes.append(sample.iloc[:0])
     return dataframes
 
-def getFields(dataframes):                  # get list of fields in each dataframe and set of unique fields for all dataframes
+def getParseCache():                        # open parse cache on first use
+    global parseCache
+    with openLock:
+        if parseCache is None and PARSE_CACHE_DIR:
+            parseCache = ParseCache(PARSE_CACHE_DIR, hashContent=PARSE_CACHE_HASH)
+    if parseCache is not None and not parseCache.enabled:   # pyarrow is not installed
+        return None
+    return parseCache
+
+def clearParseCache():                      # remove all cached parsed files
+    cache = getParseCache()
+    if cache is not None:
+        cache.clear()
+
+def compactDataFrame(df, categoryRatio = 0, exclude = (), stats = None, parsedSizes = None):  # store numeric fields in smallest dtype that holds their values, and text fields with few distinct values as categories
+    for field in df.columns:
+        if field in exclude:
+            continue
+        column = df[field]
+        if pd.api.types.is_integer_dtype(column):
+            df[field] = pd.to_numeric(column, downcast='integer')
+        elif pd.api.types.is_float_dtype(column):
+            smaller = column.astype('float32')
+            if ((smaller.astype('float64') == column) | column.isna()).all():   # only downcast floats without losing precision
+                df[field] = smaller
+        elif categoryRatio and len(column) and not isinstance(column.dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(column) and column.nunique() <= categoryRatio * len(column):
+            df[field] = column.astype('category')
+        if stats is not None:               # report memory used by field before and after
+            dtypeBefore, before = (parsedSizes or {}).get(field) or (str(column.dtype), int(column.memory_usage(deep=True, index=False)))   # fields already downcast while reading are reported as parsed
+            after = int(df[field].memory_usage(deep=True, index=False))
+            stats.setdefault('fields', []).append({'field': field, 'dtypeBefore': dtypeBefore, 'dtypeAfter': str(df[field].dtype), 'bytesBefore': before, 'bytesAfter': after})
+            stats['bytesBefore'] = stats.get('bytesBefore', 0) + before
+            stats['bytesAfter'] = stats.get('bytesAfter', 0) + after
+    return df
+
+def getFields(dataframes):                  # get list of fields in each dataframe and list of unique fields for all dataframes
     if len(dataframes) == 1:
         fields1 = list(dataframes[0])
         return fields1
     else:
-        fields1 = list(dataframes[0])
-        fields2 = list(dataframes[1])
-        fields3 = list(set(fields1 + fields2))
-        return [fields1, fields2, fields3]
+        fieldLists = [list(df) for df in dataframes]
+        allFields = []
+        for fields in fieldLists:           # keep fields in file order, adding each field name once
+            allFields.extend(field for field in fields if field not in allFields)
+        return fieldLists + [allFields]
 
-def mergeDataframes(dataframes, keys):      # merge dataframes using key values
+def mergeDataframes(dataframes, keys, how = 'inner', stats = None):   # join any number of dataframes to first dataframe using key values
     if len(dataframes) == 1:                # if one dataframe, return dataframe
         return dataframes[0]
-    else:                                   # if two dataframes, merge dataframes on key values
-        merged_df = dataframes[0].merge(dataframes[1], left_on=keys[0], right_on=keys[1])
-        return merged_df
+
+    merged_df = dataframes[0]
+    leftKeys = merged_df[keys[0]]
+    if stats is not None:
+        stats['tables'] = [{'rows': len(merged_df), 'uniqueKeys': int(leftKeys.nunique())}]
+    for i in range(1, len(dataframes)):    # join each further dataframe on its key, indexing its key once
+        df = dataframes[i]
+        keepKey = keys[i] not in merged_df.columns   # keep key field of joined table unless first table has field with same name
+        indexed = df.set_index(keys[i], drop=not keepKey)
+        if stats is not None:
+            matched = leftKeys.isin(indexed.index)
+            stats['tables'].append({'rows': len(df), 'uniqueKeys': int(indexed.index.nunique()), 'matchRate': float(matched.mean()) if len(matched) else 0.0})
+        merged_df = merged_df.join(indexed, on=keys[0], how=how, rsuffix='_' + str(i + 1))
+    merged_df = merged_df.reset_index(drop=True)    # joined rows repeat index of first table when keys repeat
+    if stats is not None:
+        stats['rows'] = len(merged_df)
+    return merged_df
+
+def getBackend():                           # create geocoder backend named by GEOCODER_BACKEND on first use, pooling its connections
+    global backend
+    with openLock:
+        if backend is None:
+            if GEOCODER_BACKEND not in geocoder.backends:
+                raise ValueError('Unknown GEOCODER_BACKEND {!r}, expected one of: {}'.format(GEOCODER_BACKEND, ', '.join(sorted(geocoder.backends))))
+            backendClass = geocoder.backends[GEOCODER_BACKEND]
+            backend = backendClass(searchURL=NOMINATIM_URL, polygonURL=OSM_POLYGON_URL, overpassURL=OVERPASS_URL, rateLimit=GEOCODE_RATE_LIMIT, retries=GEOCODE_RETRIES, backoff=GEOCODE_BACKOFF, timeout=GEOCODE_TIMEOUT, poolSize=GEOCODE_MAX_IN_FLIGHT, userAgent=HTTP_USER_AGENT, gazetteer=getGazetteer)
+    return backend
 
 def queryNominatim(query, limit = 1, countryCode = 'US'):       # query nominatim web service with parameters provided and return feature as JSON
-    nominatimBaseURL = 'https://nominatim.openstreetmap.org/search?'
-    # setup strings for query parameters and build query url
-    countryCodeParameter = '&countrycodes=' + urllib.parse.quote(countryCode)
-    limitParameter = '&limit=' + str(limit)
-    queryURL = nominatimBaseURL + query + '&format=json' + countryCodeParameter + limitParameter
+    if isinstance(query, str):              # query may be given as "q=Boston" string or dictionary of parameters
+        params = urllib.parse.parse_qsl(query)
+    else:
+        params = list(query.items())
+    endpoint = getBackend().endpoint
+    cacheKey = endpoint + '?' + '&'.join('{}={}'.format(key, value) for key, value in params) if endpoint else None   # responses of different services are kept apart
+    cache = getGeocodeCache() if endpoint else None
+    if cache is not None:                   # return cached response if query has been run before
+        item = cache.get(cacheKey, countryCode, limit)
+        if item is not None:
+            count('geocodeCacheHits')
+            return item
+        count('geocodeCacheMisses')
 
-    # run query and return JSON response
-    r = requests.get(queryURL)
-    return r.json()
+    # run query with parameters encoded by backend and return JSON response
+    item = getBackend().search(dict(params), limit, countryCode)
+    if cache is not None:                   # store response, including empty results, so reruns skip the network
+        cache.put(cacheKey, countryCode, limit, item)
+    return item
 
 def queryOSM(relationID):                   # for polygons, query OSM using relation ID to get ways and nodes
-    OSMbaseURL = 'http://polygons.openstreetmap.fr/get_geojson.py'
-    osmURL = OSMbaseURL + '?id=' + str(relationID) + '&params=0'
-
     # run query and return GeoJSON response
-    g = requests.get(osmURL)
-    return geojson.loads(g.content)
+    return geojson.loads(getBackend().polygon(relationID))
 
-def createPoints(row, place, column, state):# create point geometry for rows by calling nominatim query with place information
-    queryString = 'q='+ row[column]
-    item = queryNominatim(queryString)
+def geocodePoint(name):                     # create point geometry for place name by calling nominatim query
+    item = queryNominatim({'q': name})
     if item:                                # if item returned from query, create point object from lat,lon coordinates
-        p = Point(float(item[0]['lon']), float(item[0]['lat']))
+        p = shapelyGeometry.Point(float(item[0]['lon']), float(item[0]['lat']))
         return p
 
-def createPolygons(row, place, column, state):     # create polygon geometry for rows by calling nominatim and OSM queries with place info
-    queryString = {'County': place.lower() + '=' + row[column] + '&' + 'state=' + state, 'State': place.lower() + '=' + row[column]}    # dictionary of query strings based on place type
-    item = queryNominatim(queryString[place])
+def geocodePolygon(name, place, state):     # create polygon geometry for place name from boundary store, or by calling nominatim and OSM queries
+    store = getBoundaryStore()
+    if store is not None:                   # use stored boundary if place has been looked up or seeded before
+        polygon = store.getByName(place, name, state)
+        if polygon is not None:
+            count('boundaryStoreHits')
+            return polygon
+
+    queryParameters = {'County': {'county': name, 'state': state}, 'State': {'state': name}}    # dictionary of query parameters based on place type
+    item = queryNominatim(queryParameters[place])
     if item:                                # if item returned from query, create shape object from lat,lon coordinates
         relationID = item[0]['osm_id']
-        polygon = shape(queryOSM(relationID))
-        return polygon[0]
+        polygon = store.get(relationID) if store is not None else None
+        if polygon is None:                 # download boundary only if relation is not stored yet
+            polygon = firstGeometry(shapelyGeometry.shape(queryOSM(relationID)))
+            count('boundariesDownloaded')
+            if store is not None:
+                store.put(relationID, polygon)
+        if store is not None:
+            store.addName(relationID, place, name, state)
+        return polygon
+
+def prefetchCounties(names, state, stats = None):   # save boundaries of all counties in state to boundary store at once if some names (or, for names None, any) are not stored yet, return number saved
+    store = getBoundaryStore()
+    stateCode = normalizeState(state)
+    if store is None or not stateCode:     # needs store to look boundaries up by name afterwards
+        return 0
+    source = 'overpass:County:v2:' + stateCode   # v2 keeps only counties inside state, so states fetched before are fetched again
+    if store.sourceTime(source) is not None or (names is not None and all(store.getByName('County', name, state) is not None for name in names)):
+        return 0                            # counties of state were fetched before, names still missing are queried one by one
+
+    try:
+        saved = store.putMany(getBackend().countyBoundaries(stateCode), 'County', state, source)
+    except NotImplementedError:             # backend cannot fetch boundaries, e.g. offline gazetteer
+        return 0
+    except (geocoder.requests.RequestException, ValueError) as e:   # fall back to querying each county
+        if stats is not None:
+            stats['prefetchError'] = str(e)
+        return 0
+    instrumentation.count('boundaryPrefetches')
+    if stats is not None:
+        stats['prefetched'] = saved
+    return saved
+
+def firstGeometry(geometry):                # return first member of geometry collection returned by OSM
+    if hasattr(geometry, 'geoms') and geometry.geom_type == 'GeometryCollection':
+        return geometry.geoms[0]
+    return geometry
+
+def createPoints(row, place, column, state):# create point geometry for rows by calling nominatim query with place information
+    return geocodePoint(row[column])
+
+def createPolygons(row, place, column, state):     # create polygon geometry for rows by calling nominatim and OSM queries with place info
+    return geocodePolygon(row[column], place, state)
+
+def fuzzyGeometry(names, place, state, stats = None):   # resolve unmatched names to closest local candidate name, without network queries
+    if place == 'City':                     # city names may carry state, e.g. "Bostn, MA"
+        parts = [splitPlace(name) for name in names]
+        queries = [normalizeName(name, place, False) for name, _ in parts]   # keep "city" or "town" that is part of name, e.g. "Jersy City"
+        states = [placeState for _, placeState in parts]
+        candidates = getGazetteer().names('City')
+    else:
+        queries = [normalizeName(name, place) for name in names]
+        states = [state] * len(queries)
+        store = getBoundaryStore()
+        candidates = store.names(place, state) if store is not None else []
+
+    geometry = pd.Series([None] * len(queries), index=names.index, dtype=object)
+    if candidates:
+        report = fuzzy_match.FuzzyIndex(candidates).match(queries, threshold=FUZZY_THRESHOLD)
+        for i, (match, matchState) in enumerate(zip(report['match'], states)):
+            if match is None:
+                continue
+            if place == 'City':
+                item = getGazetteer().lookup('City', match, matchState) or getGazetteer().lookup('City', match)
+                geometry.iloc[i] = shapelyGeometry.Point(item[0], item[1]) if item else None
+            else:
+                geometry.iloc[i] = store.getByName(place, match, matchState)
+        report['query'] = names.values     # report original spelling
+    else:
+        report = pd.DataFrame({'query': names.values, 'match': None, 'score': 0.0, 'matched': False})
+    if stats is not None:
+        stats['fuzzyAttempted'] = len(queries)
+        stats['fuzzyMatched'] = int(geometry.notna().sum())
+        stats['fuzzyReport'] = report.to_dict('records')
+    return geometry
+
+def createGeometry(df, place, column, state, stats = None, progress = None, cancelEvent = None):   # geocode each unique place once, concurrently, and return geometry series aligned to df
+    if place == 'City':
+        func = geocodePoint
+    else:                                   # state is the same for every row, so place name alone identifies a county
+        func = lambda name: geocodePolygon(name, place, state)
+
+    # factorize normalized place names so repeated names are only geocoded once
+    names = df[column]
+    if isinstance(names.dtype, pd.CategoricalDtype):   # normalize each category once instead of each row
+        names = names.cat.remove_unused_categories()
+        categoryCodes, uniques = pd.factorize(pd.Series(names.cat.categories).astype(str).str.strip().str.lower())
+        codes = np.where(names.cat.codes.values >= 0, categoryCodes[names.cat.codes.values], -1)
+    else:
+        codes, uniques = pd.factorize(names.astype(str).str.strip().str.lower().where(names.notna()))
+    firstNames = names.groupby(codes).first().drop(-1, errors='ignore')   # original spelling of first row with each unique name
+    if place == 'County' and COUNTY_PREFETCH:
+        prefetchCounties(firstNames.str.strip(), state, stats)
+    if not getBackend().threaded:          # local lookups are fast enough that threads would only add overhead
+        uniqueGeometry = pd.Series([func(name) for name in firstNames.str.strip()], index=firstNames.index, dtype=object)
+    else:
+        uniqueGeometry = geocoder.geocodeSeries(firstNames.str.strip(), func, maxInFlight=GEOCODE_MAX_IN_FLIGHT, progress=progress, cancelEvent=cancelEvent)
+
+    # try to match names that could not be geocoded against local candidate names
+    missing = uniqueGeometry.isna().values
+    if FUZZY_MATCH and missing.any():
+        uniqueGeometry[missing] = fuzzyGeometry(firstNames[missing].str.strip(), place, state, stats).values
+
+    # broadcast geometry of unique names back to rows, rows without a place name get no geometry
+    geometry = pd.Series(uniqueGeometry.reindex(codes).values, index=df.index, dtype=object)
+    geometry[codes == -1] = None
+    if stats is not None:
+        stats['rows'] = len(df)
+        stats['unique'] = len(uniques)
+        stats['uniqueRatio'] = len(uniques) / float(len(df)) if len(df) else 0.0
+    return geometry
+
+def loadPolygons(place, state, stats = None, progress = None, cancelEvent = None):   # return geodataframe of names and boundaries of all counties in state, or all states
+    if place == 'County':                   # all counties of state, fetched at once or seeded from local files
+        store = getBoundaryStore()
+        if store is None:
+            raise ValueError('Aggregating by county needs the boundary store, set BOUNDARY_STORE_PATH.')
+        prefetchCounties(None, state, stats)
+        boundaries = [(name, geometry) for _, name, _, geometry in store.boundaries('County', state)]   # names as stored, e.g. "St. Louis County"
+    else:                                   # every state is looked up like a State map, stored boundaries make this fast after the first run
+        names = pd.Series(sorted(name.title().replace(' Of ', ' of ') for name in stateNames))
+        geometry = geocoder.geocodeSeries(names, lambda name: geocodePolygon(name, 'State', ''), maxInFlight=GEOCODE_MAX_IN_FLIGHT, progress=progress, cancelEvent=cancelEvent)
+        boundaries = list(zip(names, geometry))
+    boundaries = [(name, geometry) for name, geometry in boundaries if geometry is not None]
+    if not boundaries:
+        raise ValueError('No {} boundaries could be loaded{}.'.format(place.lower(), ' for ' + state if place == 'County' else ''))
+    return gpd.GeoDataFrame({'name': [name for name, _ in boundaries]}, geometry=[geometry for _, geometry in boundaries], crs='epsg:4326')
+
+def aggregatePoints(points, values, polygons, function = 'sum', valueField = 'value', stats = None):  # assign points to enclosing polygons with spatial index and return polygons with sum, mean or count of values
+    points = gpd.GeoSeries(points, crs=polygons.crs)
+    located = points.notna().values
+    pointIDs, polygonIDs = polygons.sindex.query(points[located].values, predicate='intersects')   # one vectorized STRtree query for all points
+    pointIDs, first = np.unique(pointIDs, return_index=True)  # points on shared borders only count for first polygon
+    polygonIDs = polygonIDs[first]
+    rows = np.flatnonzero(located)[pointIDs]   # positions of matched points in values
+
+    numbers = pd.to_numeric(pd.Series(values), errors='coerce').values.astype(float)[rows]
+    valid = ~np.isnan(numbers)
+    counts = np.bincount(polygonIDs, minlength=len(polygons))
+    sums = np.bincount(polygonIDs[valid], weights=numbers[valid], minlength=len(polygons))
+    if function == 'count':
+        aggregated = counts
+    elif function == 'mean':
+        valueCounts = np.bincount(polygonIDs[valid], minlength=len(polygons))
+        aggregated = np.where(valueCounts > 0, sums / np.maximum(valueCounts, 1), np.nan)
+    else:
+        aggregated = sums
+    result = polygons.copy()
+    result[valueField] = aggregated
+    result['points'] = counts
+    if stats is not None:
+        stats['function'] = function
+        stats['polygons'] = len(polygons)
+        stats['points'] = int(located.sum())
+        stats['matched'] = len(rows)
+    return result
 
 def addPoints(row, mapobj, id_field, value_field):  # add points and popups to map object
     # place circle marker at each point using coordinates, create popup with attribute info, and add to map object
     folium.CircleMarker(location = [row.geometry.y, row.geometry.x], radius=5, fill=True, popup=folium.Popup('<strong>' + row[id_field] + '</strong>' + '<br>' + value_field + ': ' + '<strong>' + str(row[value_field]) + '</strong>')).add_to(mapobj)
 
-def addPopup(row, mapobj, id_field, value_field):   # add popups for polygons to map object
-    # place polygon marker, create popup with attribute info, and add to map object
-    folium.features.PolygonMarker(locations = [(item[1],item[0]) for item in mapping(row.geometry)['coordinates'][0][0]], color='None', fill_opacity=0, popup=folium.Popup('<strong>' + row[id_field] + '</strong>' + '<br>' + value_field + ': ' + '<strong>' + str(row[value_field]) + '</strong>')).add_to(mapobj)
+def addPointCluster(gdf, mapobj, id_field, value_field):   # add points as one data array drawn by client-side marker clustering
+    points = gdf[gdf.geometry.notna()]
+    decimals = MAP_COORDINATE_DECIMALS if MAP_COORDINATE_DECIMALS is not None else 7
+    data = list(zip(np.round(points.geometry.y.values, decimals).tolist(), np.round(points.geometry.x.values, decimals).tolist(), points[id_field].astype(str).tolist(), points[value_field].astype(str).tolist()))
+    # circle markers are drawn on one shared canvas, popups are only built when a marker is clicked
+    callback = """(function () {
+        var renderer = L.canvas();
+        var label = %s;
+        var escape = function (text) { return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;'); };
+        return function (row) {
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 5, fill: true, renderer: renderer});
+            marker.bindPopup(function () { return '<strong>' + escape(row[2]) + '</strong><br>' + escape(label) + ': <strong>' + escape(row[3]) + '</strong>'; });
+            return marker;
+        };
+    })()""" % json.dumps(value_field)
+    foliumPlugins.FastMarkerCluster(data, callback=callback, name=value_field, options={'chunkedLoading': True}).add_to(mapobj)
+
+def addChoropleth(gdf, mapobj, id_field, value_field, fill_color = 'BuGn', fill_opacity = 0.7, line_opacity = 0.2):     # add choropleth symbology and popups for polygons as one GeoJSON layer
+    # only keep fields shown on map so geometry and attributes are serialized once in a single GeoJSON payload
+    layer = gdf.loc[gdf.geometry.notna(), [id_field, value_field, gdf.geometry.name]]
+    choropleth = folium.Choropleth(geo_data=layer, data=layer, name=value_field, columns=[id_field, value_field], key_on='feature.properties.{}'.format(id_field), fill_color=fill_color, fill_opacity=fill_opacity, line_opacity=line_opacity, legend_name=value_field)
+    # add popups and tooltips to choropleth layer itself, using properties already in its GeoJSON features
+    choropleth.geojson.add_child(folium.GeoJsonPopup(fields=[id_field, value_field], aliases=['', value_field + ':'], labels=True))
+    choropleth.geojson.add_child(folium.GeoJsonTooltip(fields=[id_field], labels=False))
+    choropleth.add_to(mapobj)
+
+def writeOutput(gdf, outPath, crs_wkt = None, stats = None):   # write geodataframe with driver chosen by file extension, reporting write time
+    drivers = {'.shp': 'ESRI Shapefile', '.gpkg': 'GPKG', '.fgb': 'FlatGeobuf', '.parquet': 'GeoParquet', '.geoparquet': 'GeoParquet'}     # dictionary of output formats
+    extension = os.path.splitext(outPath)[1].lower()
+    if extension not in drivers:
+        raise ValueError('Unsupported output format "{}". Use one of: {}.'.format(extension, ', '.join(sorted(drivers))))
+    driver = drivers[extension]
 
-def addChoropleth(gdf, mapobj, id_field, value_field, fill_color = 'BuGn', fill_opacity = 0.7, line_opacity = 0.2):     # add choropleth symbology for polygons
-    # call choropleth function, specify geometry as geodataframe converted to GeoJSON, data as geodataframe, layer name as value field, columns as the user-specified id field and and value field
-    mapobj.choropleth(geo_data=gdf.to_json(), data=gdf, name=value_field, columns=[id_field, value_field], key_on='feature.properties.{}'.format(id_field), fill_color=fill_color, fill_opacity=fill_opacity, line_opacity=line_opacity, legend_name=value_field, reset=True)
-    # add popups to map for all rows
-    gdf.apply(addPopup, mapobj=mapobj, id_field=id_field, value_field=value_field, axis=1)
+    # FlatGeobuf cannot index rows without geometry, which places that could not be geocoded leave, so those files are written without index
+    spatialIndex = driver == 'GPKG' or (driver == 'FlatGeobuf' and not gdf.geometry.isna().any())
+    options = {'SPATIAL_INDEX': 'YES' if spatialIndex else 'NO'} if driver in ('GPKG', 'FlatGeobuf') else {}   # GDAL indexes FlatGeobuf files unless told not to
 
-def createMap(place, gdf, id_field, value_field, outHtml): # create map object centered based on features
+    start = time.perf_counter()
+    if driver == 'GeoParquet':              # columnar file written directly from arrays
+        gdf.to_parquet(outPath)
+    elif importlib.util.find_spec('pyogrio') is not None:  # pyogrio writes whole columns at once instead of feature by feature
+        gdf.to_file(outPath, driver=driver, engine='pyogrio', use_arrow=importlib.util.find_spec('pyarrow') is not None, layer_options=options)
+    else:
+        if driver == 'ESRI Shapefile' and crs_wkt:   # fiona writes given WKT to .prj file
+            options['crs_wkt'] = crs_wkt
+        gdf.to_file(outPath, driver=driver, **options)
+    if stats is not None:
+        stats.append({'path': outPath, 'driver': driver, 'features': len(gdf), 'seconds': time.perf_counter() - start})
+        if driver == 'FlatGeobuf' and not spatialIndex:
+            stats[-1]['note'] = 'written without spatial index because {} rows have no geometry'.format(int(gdf.geometry.isna().sum()))
+
+def simplifyForMap(gdf, zoom, stats = None):   # return copy of polygons simplified for zoom level with quantized coordinates
+    geometry = np.array(gdf.geometry.values, dtype=object)
+    valid = ~shapely.is_missing(geometry)
+    # rows of merged tables repeat the geometry object of each place, so each object is simplified once, duplicates are not a valid coverage
+    codes, _ = pd.factorize(np.array([id(item) for item in geometry[valid]], dtype=np.int64))
+    unique = geometry[valid][np.unique(codes, return_index=True)[1]]
+    simplified = unique.copy()
+    tolerance = MAP_SIMPLIFY_PIXELS * 360.0 / (256 * 2 ** zoom)    # degrees covered by tolerance in pixels at zoom level
+    if tolerance > 0 and len(unique):
+        if hasattr(shapely, 'coverage_simplify') and shapely.coverage_is_valid(unique):    # simplify shared borders once so neighbouring polygons do not gap or overlap
+            simplified = shapely.coverage_simplify(unique, tolerance)
+        else:                               # older shapely/GEOS, or overlapping polygons, can only be simplified each on its own
+            simplified = shapely.simplify(unique, tolerance, preserve_topology=True)
+    if MAP_COORDINATE_DECIMALS is not None and len(unique):   # round coordinates so map HTML does not carry sub-metre digits
+        simplified = shapely.transform(simplified, lambda coords: np.round(coords, MAP_COORDINATE_DECIMALS))
+    if stats is not None:                   # vertices of each distinct polygon, as drawn on map
+        stats['verticesBefore'] = int(shapely.get_num_coordinates(unique).sum())
+        stats['verticesAfter'] = int(shapely.get_num_coordinates(simplified).sum())
+    result = np.array([None] * len(geometry), dtype=object)
+    result[valid] = simplified[codes]
+    return gdf.set_geometry(gpd.GeoSeries(result, index=gdf.index, crs=gdf.crs))
+
+def createMap(place, gdf, id_field, value_field, outHtml, stats = None): # create map object centered based on features
     zoom = {'City': 4, 'County': 6, 'State': 4}            # set zoom level based on place type
-    mapobj = folium.Map(location=[gdf.unary_union.centroid.y, gdf.unary_union.centroid.x], tiles='Cartodb Positron', zoom_start=zoom[place])    # set map center based on features, basemap, zoom level
-    if place == 'City':                                    # if cities, add points to map object
-        gdf.apply(addPoints, mapobj=mapobj, id_field=id_field, value_field=value_field, axis=1)
-    else:                                                  # if counties or states, add polygons to map object
-        addChoropleth(gdf, mapobj, id_field, value_field)
-    mapobj.save(outHtml)                                   # save map object to html file
\ No newline at end of file
+    if MAP_OUTPUT_MODE == 'tiled' or (MAP_OUTPUT_MODE == 'auto' and len(gdf) > TILED_FEATURE_THRESHOLD):   # write tiles and viewer for very large layers
+        tileStats = tiled_map.writeTiledMap(gdf, id_field, value_field, outHtml, zoom[place], simplify=simplifyForMap)
+        if stats is not None:
+            stats.update(tileStats)
+        return
+    minx, miny, maxx, maxy = gdf.total_bounds  # center of bounding box, cheaper than dissolving many features to find centroid
+    mapobj = folium.Map(location=[(miny + maxy) / 2.0, (minx + maxx) / 2.0], tiles='Cartodb Positron', zoom_start=zoom[place])    # set map center based on features, basemap, zoom level
+    if place == 'City' and len(gdf) > POINT_CLUSTER_THRESHOLD:    # if many cities, add points as one clustered layer
+        addPointCluster(gdf, mapobj, id_field, value_field)
+    elif place == 'City':                                  # if cities, add located points to map object
+        gdf[gdf.geometry.notna()].apply(addPoints, mapobj=mapobj, id_field=id_field, value_field=value_field, axis=1)
+    else:                                                  # if counties or states, add simplified polygons to map object
+        addChoropleth(simplifyForMap(gdf, zoom[place], stats), mapobj, id_field, value_field)
+    mapobj.save(outHtml)                                   # save map object to html file
+
+def fingerprint(*parts):                    # return hash identifying stage inputs
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def fileSignature(paths):                   # return (path, size, modification time) of files, so changed or deleted files are detected
+    signature = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+            signature.append((os.path.abspath(path), info.st_size, info.st_mtime_ns))
+        except OSError:
+            signature.append((os.path.abspath(path), None, None))
+    return signature
+
+def cachedStage(name, key, compute, stats, outputs = None, progress = None):   # return result of stage from last run if its inputs and output files are unchanged, else run compute(stats)
+    entry = stageCache.get(name)
+    if STAGE_CACHE and entry is not None and entry[0] == key and (outputs is None or entry[3] == fileSignature(outputs)):
+        if progress is not None:
+            progress('Reusing {} results of previous run...'.format(name))
+        if isinstance(stats, list):         # statistics of reused stage, marked as cached
+            stats.extend(dict(item, cached=True) for item in entry[2])
+        else:
+            stats.update(entry[2], cached=True)
+        return entry[1]
+
+    stageCache.pop(name, None)              # drop old result first so both are not held in memory at once
+    result = compute(stats)
+    if STAGE_CACHE:
+        stageCache[name] = (key, result, [dict(item) for item in stats] if isinstance(stats, list) else dict(stats), fileSignature(outputs) if outputs is not None else None)
+    return result
+
+def clearStageCache():                      # forget results of last run, e.g. after files were edited in place
+    stageCache.clear()
+
+def runPipeline(files, delimiter, keys, place, placeField, valueField, attributes, state, outShapefile, outHtml, progress = None, cancelEvent = None, aggregate = None):   # load, merge, geocode, write output file(s) and create map, returning run statistics
+    outFiles = [outShapefile] if isinstance(outShapefile, str) else list(outShapefile)     # one or more output files, format chosen by extension
+    report = progress or (lambda message: None)
+    stats = {}
+    resetCacheStats()                       # cache hits and misses are reported for this run only
+
+    def checkCancelled():                   # stop between stages when user has cancelled the run
+        if cancelEvent is not None and cancelEvent.is_set():
+            raise Cancelled('Run was cancelled.')
+
+    # set projections: WGS84 projection for geopanda and WKT for shapefile
+    crs4326 = 'epsg:4326'
+    crs = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.01745329251994328,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+
+    # each stage is skipped when its inputs match the last run, e.g. changing only the value field just re-creates the map
+    mergeKey = fingerprint(fileSignature(files), delimiter, keys, attributes)
+    geocodePlace = 'City' if place in aggregations else place     # aggregation places geocode cities first
+    aggregate = aggregate or AGGREGATE_FUNCTION
+    geometryKey = fingerprint(mergeKey, geocodePlace, placeField, state, GEOCODER_BACKEND, GAZETTEER_FILES, FUZZY_MATCH, FUZZY_THRESHOLD, NOMINATIM_URL, OSM_POLYGON_URL)
+
+    # record time, event counts, rows and memory of each stage
+    recorder = instrumentation.RunRecorder(profile=PROFILE_RUN)
+    recorder.start()
+    try:
+        # read files in chunks, only parsing the desired attribute fields and key fields, then merge dataframes and only keep desired attribute fields
+        def merge(stageStats):              # loaded dataframes are not kept, only the merged result (reloading is fast with the parse cache)
+            report('Reading {} file(s)...'.format(len(files)))
+            parsedSizes = []
+            dataframes = createDF(files, delimiter, usecols=attributes + keys, parsedSizes=parsedSizes)
+            if COMPACT_DATAFRAMES:          # key fields keep their dtype so joins match them as before
+                report('Compacting data...')
+                dataframes = [compactDataFrame(df, CATEGORY_MAX_RATIO, exclude=keys, stats=stageStats.setdefault('compact', {}), parsedSizes=sizes) for df, sizes in zip(dataframes, parsedSizes)]
+            checkCancelled()
+            report('Merging data...')
+            return mergeDataframes(dataframes, keys, stats=stageStats)[attributes]
+        with recorder.stage('merge') as record:
+            merged_df = cachedStage('merge', mergeKey, merge, stats.setdefault('merge', {}), progress=report)
+            record.update(rows=len(merged_df), cached=bool(stats['merge'].get('cached')))
+        checkCancelled()
+
+        # create geometry based on place type specified, and geopanda with geometry
+        def geometry(stageStats):
+            report('Geocoding places...')
+            geometryList = createGeometry(merged_df, geocodePlace, placeField, state, stats=stageStats, progress=lambda done, total: report('Geocoded {} of {} places...'.format(done, total)), cancelEvent=cancelEvent)
+            return gpd.GeoDataFrame(merged_df, crs=crs4326, geometry=geometryList)
+        with recorder.stage('geometry') as record:
+            dataframeGeo = cachedStage('geometry', geometryKey, geometry, stats.setdefault('geometry', {}), progress=report)
+            record.update(rows=len(dataframeGeo), cached=bool(stats['geometry'].get('cached')))
+        checkCancelled()
+
+        # roll city values up into enclosing counties or states, which are then written and mapped instead of the cities
+        if place in aggregations:
+            def aggregatePlaces(stageStats):
+                report('Loading {} boundaries...'.format(aggregations[place].lower()))
+                polygons = loadPolygons(aggregations[place], state, stageStats, progress=lambda done, total: report('Loaded {} of {} boundaries...'.format(done, total)), cancelEvent=cancelEvent)
+                report('Aggregating {} rows into {} polygons...'.format(len(dataframeGeo), len(polygons)))
+                return aggregatePoints(dataframeGeo.geometry, dataframeGeo[valueField].values, polygons, aggregate, valueField, stageStats)
+            with recorder.stage('aggregate') as record:
+                dataframeGeo = cachedStage('aggregate', fingerprint(geometryKey, place, valueField, aggregate), aggregatePlaces, stats.setdefault('aggregate', {}), progress=report)
+                record.update(rows=stats['aggregate'].get('points'), cached=bool(stats['aggregate'].get('cached')))
+            geometryKey = fingerprint(geometryKey, place, valueField, aggregate)    # output and map depend on aggregated polygons
+            place, placeField = aggregations[place], 'name'
+            checkCancelled()
+
+        # write data to output files
+        def write(writeStats):
+            for outFile in outFiles:
+                report('Writing {} features to {}...'.format(len(dataframeGeo), os.path.basename(outFile)))
+                writeOutput(dataframeGeo, outFile, crs_wkt=crs, stats=writeStats)
+                report('Wrote {} features to {} in {:.1f} s.'.format(len(dataframeGeo), os.path.basename(outFile), writeStats[-1]['seconds']))
+                checkCancelled()
+        with recorder.stage('write') as record:
+            cachedStage('write', fingerprint(geometryKey, outFiles), write, stats.setdefault('write', []), outputs=outFiles, progress=report)
+            record.update(rows=len(dataframeGeo) * len(outFiles), cached=any(item.get('cached') for item in stats['write']))
+
+        # create folium map object from geodataframe, add features to map, and save as html file
+        def render(stageStats):
+            report('Creating map...')
+            createMap(place, dataframeGeo, placeField, valueField, outHtml, stats=stageStats)
+        renderKey = fingerprint(geometryKey, place, placeField, valueField, outHtml, MAP_OUTPUT_MODE, TILED_FEATURE_THRESHOLD, POINT_CLUSTER_THRESHOLD, MAP_SIMPLIFY_PIXELS, MAP_COORDINATE_DECIMALS)
+        with recorder.stage('map') as record:
+            cachedStage('map', renderKey, render, stats.setdefault('map', {}), outputs=[outHtml], progress=report)
+            record.update(rows=len(dataframeGeo), cached=bool(stats['map'].get('cached')))
+    finally:
+        recorder.stop()                     # also stops profiler when run fails or is cancelled
+
+    stats['timing'] = recorder.report()
+    stats['summary'] = recorder.summary()
+    if RUN_REPORT:                          # write machine-readable run report next to map
+        stats['report'] = os.path.splitext(outHtml)[0] + '_report.json'
+        recorder.write(stats['report'])
+
+    stats['cache'] = getCacheStats()
+    return stats
+
+def runMessage(stats):                      # return status bar message summarizing statistics of successful run
+    message = "Success! Tool has created shapefile and map. Geocoded {} unique places for {} rows. Geocoding cache: {} hits, {} misses.".format(stats['geometry']['unique'], stats['geometry']['rows'], stats['cache']['hits'], stats['cache']['misses'])
+    if 'aggregate' in stats:    # city rows were rolled up into polygons
+        message += " Aggregated {} of {} located rows into {} polygons ({}).".format(stats['aggregate']['matched'], stats['aggregate']['points'], stats['aggregate']['polygons'], stats['aggregate']['function'])
+    if 'fuzzyAttempted' in stats['geometry']:   # some names were not found and were matched to similar names
+        message += " Fuzzy matched {} of {} unmatched names.".format(stats['geometry']['fuzzyMatched'], stats['geometry']['fuzzyAttempted'])
+    if 'compact' in stats['merge']:     # fields were stored in smaller dtypes after loading
+        message += " Compacted loaded data from {:.1f} MB to {:.1f} MB.".format(stats['merge']['compact'].get('bytesBefore', 0) / 1048576.0, stats['merge']['compact'].get('bytesAfter', 0) / 1048576.0)
+    message += " Wrote output in " + ", ".join("{:.1f} s ({})".format(item['seconds'], item['driver']) for item in stats['write']) + "."
+    for item in stats['write']:     # output written differently than requested, e.g. without spatial index
+        if 'note' in item:
+            message += " {} {}.".format(os.path.basename(item['path']), item['note'])
+    reused = [stage for stage in ('merge', 'geometry', 'map') if stats[stage].get('cached')]
+    if any(item.get('cached') for item in stats['write']):
+        reused.insert(-1 if 'map' in reused else len(reused), 'write')
+    if reused:                  # stages whose inputs did not change were not run again
+        message += " Reused unchanged results of previous run: " + ", ".join(reused) + "."
+    message += " Stage times: " + stats['summary'] + "."
+    if 'verticesBefore' in stats['map']:    # polygons were simplified for map
+        message += " Map vertices simplified from {} to {}.".format(stats['map']['verticesBefore'], stats['map']['verticesAfter'])
+    return message
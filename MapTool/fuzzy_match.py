@@ -0,0 +1,101 @@
+# -----------------------------------------------------------------------------------------
+# Name: fuzzy_match.py
+# Description: Matches misspelled place names against a local list of known names, using
+#              trigram blocking to pick a few candidates per name and a vectorized edit
+#              distance to score them
+#------------------------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+def trigrams(text):                         # return set of 3-character grams of text padded with spaces
+    text = '  ' + text + ' '
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+def encode(strings):                        # return padded array of character codes and array of string lengths
+    lengths = np.array([len(s) for s in strings], dtype=np.int64)
+    codes = np.zeros((len(strings), max(int(lengths.max()) if len(strings) else 0, 1)), dtype=np.int32)
+    characters = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.int32)
+    rows = np.repeat(np.arange(len(strings)), lengths)
+    columns = np.arange(len(characters)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes[rows, columns] = characters
+    return codes, lengths
+
+def editDistance(a, b):                     # Levenshtein distance of each pair a[i], b[i], computed for all pairs at once
+    A, lenA = encode(a)
+    B, lenB = encode(b)
+    A, B = A.T.copy(), B.T.copy()           # one row per character position so each step works on contiguous memory
+    previous = np.repeat(np.arange(B.shape[0] + 1, dtype=np.int16)[:, None], len(a), axis=1)
+    current = np.empty_like(previous)
+    pairs = np.arange(len(a))
+    distance = lenB.copy()                  # distance for empty strings in a
+    for i in range(1, A.shape[0] + 1):
+        current[0] = i
+        np.add(previous[:-1], B != A[i - 1], out=current[1:], casting='unsafe')   # substitution
+        np.minimum(current[1:], previous[1:] + 1, out=current[1:])                 # deletion
+        for j in range(1, B.shape[0] + 1):  # insertions depend on the cell to the left, so positions are processed in order
+            np.minimum(current[j], current[j - 1] + 1, out=current[j])
+        finished = lenA == i                # pairs whose first string ends at this row
+        distance[finished] = current[lenB[finished], pairs[finished]]
+        previous, current = current, previous
+    return distance
+
+class FuzzyIndex(object):
+    def __init__(self, names):              # build trigram index of candidate names
+        self.names = list(names)
+        postings = {}
+        for i, name in enumerate(self.names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(i)
+        self.postings = dict((gram, np.array(ids, dtype=np.int64)) for gram, ids in postings.items())
+        self.commonSize = max(100, len(self.names) // 100)     # grams in more names than this do little to narrow down candidates
+
+    def candidates(self, queries, maxCandidates):   # return (query index, candidate index) pairs of names sharing the most trigrams
+        queryIDs, postings = [], []
+        for q, query in enumerate(queries):
+            grams = [self.postings[gram] for gram in trigrams(query) if gram in self.postings]
+            rare = [ids for ids in grams if len(ids) <= self.commonSize]
+            for ids in (rare or grams):     # skip grams shared by many names unless query has no other grams
+                queryIDs.append(q)
+                postings.append(ids)
+        if not postings:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        candidateIDs = np.concatenate(postings)
+        queryIDs = np.repeat(np.array(queryIDs, dtype=np.int64), [len(ids) for ids in postings])
+
+        # count shared trigrams of each (query, candidate) pair and keep best candidates per query
+        keys, shared = np.unique(queryIDs * len(self.names) + candidateIDs, return_counts=True)
+        queryIDs, candidateIDs = keys // len(self.names), keys % len(self.names)
+        order = np.lexsort((-shared, queryIDs))
+        queryIDs, candidateIDs = queryIDs[order], candidateIDs[order]
+        firsts = np.r_[0, np.flatnonzero(np.diff(queryIDs)) + 1]
+        rank = np.arange(len(queryIDs)) - np.repeat(firsts, np.diff(np.r_[firsts, len(queryIDs)]))
+        keep = rank < maxCandidates
+        return queryIDs[keep], candidateIDs[keep]
+
+    def match(self, queries, threshold = 0.85, maxCandidates = 10, batchSize = 2000):   # return dataframe of best candidate and score for each query
+        queries = list(queries)
+        best = np.full(len(queries), -1, dtype=np.int64)
+        scores = np.zeros(len(queries))
+        for start in range(0, len(queries), batchSize):    # batches keep candidate pair arrays small
+            batch = queries[start:start + batchSize]
+            queryIDs, candidateIDs = self.candidates(batch, maxCandidates)
+            if not len(queryIDs):
+                continue
+            a = [batch[q] for q in queryIDs]
+            b = [self.names[c] for c in candidateIDs]
+            lengthA, lengthB = np.array([len(s) for s in a]), np.array([len(s) for s in b])
+            longest = np.maximum(lengthA, lengthB).clip(min=1)
+            possible = np.abs(lengthA - lengthB) <= (1.0 - threshold) * longest     # length difference alone already rules out other pairs
+            if not possible.any():
+                continue
+            queryIDs, candidateIDs, longest = queryIDs[possible], candidateIDs[possible], longest[possible]
+            a = [s for s, ok in zip(a, possible) if ok]
+            b = [s for s, ok in zip(b, possible) if ok]
+            similarity = 1.0 - editDistance(a, b) / longest
+            order = np.lexsort((-similarity, queryIDs))     # best scoring candidate first for each query
+            firsts = order[np.r_[0, np.flatnonzero(np.diff(queryIDs[order])) + 1]]
+            best[start + queryIDs[firsts]] = candidateIDs[firsts]
+            scores[start + queryIDs[firsts]] = similarity[firsts]
+        matched = (best >= 0) & (scores >= threshold)
+        return pd.DataFrame({'query': queries, 'match': [self.names[c] if ok else None for c, ok in zip(best, matched)], 'score': scores, 'matched': matched})
@@ -0,0 +1,93 @@
+# -----------------------------------------------------------------------------------------
+# Name: gazetteer.py
+# Description: Offline geocoder that loads gazetteer files (e.g. U.S. Census Gazetteer files of
+#              places, counties and states) into an in-memory index keyed by normalized name
+#              and state, used in place of Nominatim queries
+#------------------------------------------------------------------------------------------
+
+import re, csv
+
+states = {'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR', 'california': 'CA', 'colorado': 'CO', 'connecticut': 'CT',
+          'delaware': 'DE', 'district of columbia': 'DC', 'florida': 'FL', 'georgia': 'GA', 'hawaii': 'HI', 'idaho': 'ID', 'illinois': 'IL',
+          'indiana': 'IN', 'iowa': 'IA', 'kansas': 'KS', 'kentucky': 'KY', 'louisiana': 'LA', 'maine': 'ME', 'maryland': 'MD',
+          'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN', 'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT',
+          'nebraska': 'NE', 'nevada': 'NV', 'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM', 'new york': 'NY',
+          'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH', 'oklahoma': 'OK', 'oregon': 'OR', 'pennsylvania': 'PA',
+          'puerto rico': 'PR', 'rhode island': 'RI', 'south carolina': 'SC', 'south dakota': 'SD', 'tennessee': 'TN', 'texas': 'TX',
+          'utah': 'UT', 'vermont': 'VT', 'virginia': 'VA', 'washington': 'WA', 'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY'}     # dictionary of state names and USPS codes
+stateCodes = set(states.values())
+
+abbreviations = {'st': 'saint', 'ste': 'sainte', 'ft': 'fort', 'mt': 'mount', 'pt': 'point'}   # dictionary of abbreviations expanded before matching
+suffixes = {'City': ('city', 'town', 'village', 'borough', 'cdp', 'municipality'), 'County': ('county', 'parish', 'borough', 'census area', 'city and borough', 'municipality'), 'State': ()}     # place type words removed from end of names
+
+def normalizeState(state):                  # return USPS code for state name or code, or '' if not a state
+    state = ' '.join(re.sub(r'[^a-z ]', ' ', str(state or '').lower()).split())
+    if state.upper() in stateCodes:
+        return state.upper()
+    return states.get(state, '')
+
+def normalizeName(name, place = 'City', stripSuffix = True):   # lowercase name, drop punctuation, expand abbreviations and drop place type suffix
+    words = re.sub(r"[^\w ]", ' ', str(name).lower().replace("'", '')).split()
+    words = [abbreviations.get(word, word) for word in words]
+    text = ' '.join(words)
+    if not stripSuffix:
+        return text
+    for suffix in sorted(suffixes.get(place, ()), key=len, reverse=True):
+        if text.endswith(' ' + suffix):
+            text = text[:-len(suffix) - 1]
+            break
+    return text
+
+def splitPlace(text):                       # split "Boston, MA" or "Boston, Massachusetts" into name and state code
+    parts = [part.strip() for part in str(text).split(',')]
+    if len(parts) > 1 and normalizeState(parts[-1]):
+        return ', '.join(parts[:-1]), normalizeState(parts[-1])
+    return str(text).strip(), ''
+
+class Gazetteer(object):
+    def __init__(self):
+        self.index = {}                     # (place type, normalized name, state code) -> (lon, lat)
+        self.stripped = {}                  # same, with place type word removed from end of name, e.g. "Jersey City city" as "jersey city"
+
+    def load(self, path, place, nameField = 'NAME', stateField = 'USPS', latField = 'INTPTLAT', lonField = 'INTPTLONG'):   # add places from delimited gazetteer file, return number of places added
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            sample = f.read(65536)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters='\t,|;')
+            except csv.Error:
+                dialect = csv.excel_tab     # Census gazetteer files are tab delimited
+            reader = csv.reader(f, dialect)
+            header = [field.strip() for field in next(reader)]     # Census files pad last field name with spaces
+            nameIndex, latIndex, lonIndex = header.index(nameField), header.index(latField), header.index(lonField)
+            stateIndex = header.index(stateField) if stateField in header else None
+            count = 0
+            for row in reader:
+                if len(row) < len(header):
+                    continue
+                state = normalizeState(row[stateIndex]) if stateIndex is not None else ''
+                if place == 'State':        # state files list the state itself in the name field
+                    state = normalizeState(row[nameIndex]) or state
+                self.add(place, row[nameIndex], state, float(row[lonIndex]), float(row[latIndex]))
+                count += 1
+        return count
+
+    def add(self, place, name, state, lon, lat):    # add place under name with state and name alone, first place wins for ambiguous names
+        for table, key in ((self.index, normalizeName(name, place, False)), (self.stripped, normalizeName(name, place))):
+            table.setdefault((place, key, state), (lon, lat))
+            table.setdefault((place, key, ''), (lon, lat))
+
+    def lookup(self, place, name, state = ''):      # return (lon, lat) of place, or None if not in gazetteer
+        if place == 'City' and not state:   # city names may include state, e.g. "Boston, MA"
+            name, state = splitPlace(name)
+        state = normalizeState(state)
+        for key in (normalizeName(name, place, False), normalizeName(name, place)):   # name as typed first, so "Jersey City" is not looked up as "jersey"
+            for table in (self.index, self.stripped):
+                item = table.get((place, key, state))
+                if item is not None:
+                    return item
+        return None
+
+    def names(self, place, state = ''):     # return normalized names of places, with and without place type word, optionally only those in state
+        state = normalizeState(state)
+        return sorted(set(key[1] for table in (self.index, self.stripped) for key in table if key[0] == place and key[2] == state))
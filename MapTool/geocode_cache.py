@@ -0,0 +1,89 @@
+# -----------------------------------------------------------------------------------------
+# Name: geocode_cache.py
+# Description: Persistent SQLite cache for geocoding responses used by core_functions.py
+#------------------------------------------------------------------------------------------
+
+import os, json, time, sqlite3, threading
+
+class GeocodeCache(object):
+    def __init__(self, path, ttl = 30 * 24 * 3600, maxEntries = 100000):     # open (or create) cache database at path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.ttl = ttl                      # seconds before an entry is considered stale, None to keep entries forever
+        self.maxEntries = maxEntries        # maximum number of entries kept before least recently used entries are evicted
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}                  # access times of hits not yet written, saved in batches instead of one commit per hit
+        self._nextExpiry = 0.0              # time after which stale entries are removed again
+        self._lock = threading.Lock()       # connection is shared between threads, so serialize access
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)   # wait for batch worker processes writing to same database
+        self._conn.execute('CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode (accessed)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS geocode_created ON geocode (created)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+
+    @staticmethod
+    def makeKey(query, countryCode, limit):     # normalize query string so equivalent queries share one entry
+        query = ' '.join(str(query).lower().split())
+        return '{}|{}|{}'.format(query, str(countryCode).lower(), limit)
+
+    def get(self, query, countryCode, limit):   # return cached response or None, counting hits and misses
+        key = self.makeKey(query, countryCode, limit)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created FROM geocode WHERE key = ?', (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= 500:
+                self._flush()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query, countryCode, limit, response):    # store response, evicting stale and least recently used entries in batches
+        key = self.makeKey(query, countryCode, limit)
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM geocode WHERE key = ?', (key,)).fetchone() is not None
+            self._conn.execute('INSERT OR REPLACE INTO geocode (key, response, created, accessed) VALUES (?, ?, ?, ?)', (key, json.dumps(response), now, now))
+            self._touched.pop(key, None)
+            self._size += 0 if exists else 1
+            if self.ttl is not None and now >= self._nextExpiry:    # stale entries are looked for at most once an hour
+                self._size -= self._conn.execute('DELETE FROM geocode WHERE created < ?', (now - self.ttl,)).rowcount
+                self._nextExpiry = now + min(self.ttl, 3600)
+            if self.maxEntries and self._size > self.maxEntries * 1.1:   # evict down to limit only once it is exceeded by 10 %
+                self._flush()
+                self._size -= self._conn.execute('DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.maxEntries,)).rowcount
+            self._conn.commit()
+
+    def _flush(self):                           # write access times of recent hits, caller holds lock
+        if self._touched:
+            self._conn.executemany('UPDATE geocode SET accessed = ? WHERE key = ?', [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched.clear()
+            self._conn.commit()
+
+    def stats(self):                            # return hit/miss counters and number of stored entries
+        with self._lock:
+            self._flush()
+            size = self._conn.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': size}
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):                            # remove all entries from cache
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute('DELETE FROM geocode')
+            self._conn.commit()
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
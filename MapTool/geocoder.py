@@ -0,0 +1,173 @@
+# -----------------------------------------------------------------------------------------
+# Name: geocoder.py
+# Description: Concurrent, rate-limited request engine used by core_functions.py to geocode
+#              a whole place column instead of one blocking request per row
+#------------------------------------------------------------------------------------------
+
+import time, threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lazy_imports import lazyImport
+from instrumentation import count
+
+requests = lazyImport('requests')
+shapely = lazyImport('shapely')
+shapelyGeometry = lazyImport('shapely.geometry')
+shapelyOps = lazyImport('shapely.ops')
+pd = lazyImport('pandas')
+
+class Cancelled(Exception):                  # raised when a running job is cancelled by the user
+    pass
+
+class RateLimiter(object):
+    def __init__(self, rate):               # rate is the maximum number of calls per second, None or 0 for no limit
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):                         # block until the next call is allowed
+        if not self.interval:
+            return
+        with self._lock:                    # reserve the next free slot, then sleep outside the lock
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+_limiters = {}
+_limitersLock = threading.Lock()
+
+def getLimiter(url, rateLimit):             # return rate limiter shared by all requests to host of url
+    host = urllib.parse.urlsplit(url).netloc
+    with _limitersLock:
+        if host not in _limiters:
+            _limiters[host] = RateLimiter(rateLimit)
+        return _limiters[host]
+
+def createSession(poolSize = 10, userAgent = 'MapTool'):   # create session that keeps connections to each host open and reuses them
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = userAgent       # Nominatim usage policy requires an identifying user agent
+    return session
+
+def httpGet(url, params = None, session = None, rateLimit = 1.0, retries = 3, backoff = 1.0, timeout = 30):   # run GET request under per-host rate limit, retry with backoff on failure
+    limiter = getLimiter(url, rateLimit)
+    get = session.get if session is not None else requests.get
+    for attempt in range(retries + 1):
+        limiter.wait()
+        count('httpRequests' if attempt == 0 else 'httpRetries')
+        try:
+            r = get(url, params=params, timeout=timeout)
+            if r.status_code != 429 and r.status_code < 500:   # only retry when server is throttling or failing
+                r.raise_for_status()
+                return r
+            error = requests.HTTPError('{} returned status {}'.format(url, r.status_code), response=r)
+        except requests.HTTPError:
+            raise
+        except requests.RequestException as e:
+            error = e
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)     # wait longer after each failed attempt
+    raise error
+
+class GeocoderBackend(object):              # interface of geocoding services, register new backends in backends dictionary
+    endpoint = None                         # URL responses come from, part of geocode cache key, None if responses are not cached
+    threaded = True                         # run searches on worker threads, False when lookups are local and threads would only add overhead
+
+    def search(self, params, limit = 1, countryCode = 'US'):   # return list of matches in Nominatim JSON format for query parameters
+        raise NotImplementedError
+
+    def polygon(self, relationID):          # return boundary of OSM relation as GeoJSON text
+        raise NotImplementedError
+
+    def countyBoundaries(self, stateCode):  # return (relation ID, name, geometry) of every county in state, for fetching them all at once
+        raise NotImplementedError
+
+class NominatimBackend(GeocoderBackend):    # Nominatim search and OSM polygon services, or a stub server replaying their responses
+    def __init__(self, searchURL = 'https://nominatim.openstreetmap.org/search', polygonURL = 'http://polygons.openstreetmap.fr/get_geojson.py', overpassURL = 'https://overpass-api.de/api/interpreter', rateLimit = 1.0, retries = 3, backoff = 1.0, timeout = 30, poolSize = 10, userAgent = 'MapTool', **options):
+        self.searchURL = searchURL
+        self.endpoint = searchURL           # responses of a stub server are cached apart from those of the real service
+        self.polygonURL = polygonURL
+        self.overpassURL = overpassURL
+        self.options = {'rateLimit': rateLimit, 'retries': retries, 'backoff': backoff, 'timeout': timeout}
+        self.session = createSession(poolSize, userAgent)
+
+    def search(self, params, limit = 1, countryCode = 'US'):
+        params = dict(params, format='json', countrycodes=countryCode, limit=limit)
+        return httpGet(self.searchURL, params=params, session=self.session, **self.options).json()
+
+    def polygon(self, relationID):
+        return httpGet(self.polygonURL, params={'id': relationID, 'params': 0}, session=self.session, **self.options).content
+
+    def countyBoundaries(self, stateCode):  # one Overpass query returns state and all county relations in it with the coordinates of their ways
+        options = dict(self.options, timeout=max(self.options['timeout'], 180))    # large states take a while to assemble
+        data = httpGet(self.overpassURL, params={'data': countyQuery.format(stateCode)}, session=self.session, **options).json()
+        return countiesInState(data.get('elements', []), stateCode)
+
+# state relation and counties touching state area, which includes counties of neighbouring states that share border ways
+countyQuery = '[out:json][timeout:180];area["ISO3166-2"="US-{}"]["admin_level"="4"]->.state;(rel(pivot.state);rel(area.state)["boundary"="administrative"]["admin_level"="6"];);out geom;'
+
+def countiesInState(elements, stateCode):   # return (relation ID, name, geometry) of county relations whose interior point lies inside state relation
+    relations = [element for element in elements if element.get('type') == 'relation']
+    state = [element for element in relations if element.get('tags', {}).get('ISO3166-2') == 'US-' + stateCode]
+    stateGeometry = relationGeometry(state[0]) if state else None
+    counties = []
+    for element in relations:
+        if element.get('tags', {}).get('admin_level') == '4':
+            continue
+        geometry = relationGeometry(element)
+        if geometry is not None and stateGeometry is not None and not stateGeometry.contains(geometry.representative_point()):
+            continue                        # county of neighbouring state
+        counties.append((element['id'], element.get('tags', {}).get('name'), geometry))
+    return counties
+
+def relationGeometry(relation):             # assemble polygon of relation returned by Overpass "out geom" from its outer and inner ways, None if rings do not close
+    lines = {'outer': [], 'inner': []}
+    for member in relation.get('members', []):
+        points = member.get('geometry') or []
+        if member.get('type') == 'way' and len(points) > 1:
+            lines['inner' if member.get('role') == 'inner' else 'outer'].append(shapelyGeometry.LineString([(point['lon'], point['lat']) for point in points]))
+    outer = list(shapelyOps.polygonize(lines['outer']))    # rings are usually split over several ways, polygonize joins them at shared end points
+    if not outer:
+        return None
+    polygon = shapely.union_all(outer)
+    inner = list(shapelyOps.polygonize(lines['inner']))
+    if inner:
+        polygon = polygon.difference(shapely.union_all(inner))
+    return polygon
+
+class GazetteerBackend(GeocoderBackend):    # offline lookups of city points in gazetteer files, polygons only come from boundary store
+    threaded = False
+
+    def __init__(self, gazetteer = None, **options):   # gazetteer is a function returning loaded Gazetteer, so files are only read when backend is used
+        self.gazetteer = gazetteer
+
+    def search(self, params, limit = 1, countryCode = 'US'):   # only free text city queries can be answered, counties and states are not in gazetteer
+        item = self.gazetteer().lookup('City', params['q']) if 'q' in params and self.gazetteer is not None else None
+        if item is None:
+            return []
+        return [{'lon': item[0], 'lat': item[1]}]
+
+    def polygon(self, relationID):          # search never returns OSM relations
+        raise NotImplementedError
+
+backends = {'nominatim': NominatimBackend, 'gazetteer': GazetteerBackend}  # dictionary of backend names and classes
+
+def geocodeSeries(values, func, maxInFlight = 4, progress = None, cancelEvent = None):  # apply func to every value concurrently and return results aligned to index of values
+    values = pd.Series(values)
+    results = [None] * len(values)
+    executor = ThreadPoolExecutor(max_workers=maxInFlight)
+    try:
+        futures = dict((executor.submit(func, value), i) for i, value in enumerate(values.tolist()))
+        for done, future in enumerate(as_completed(futures), 1):
+            if cancelEvent is not None and cancelEvent.is_set():    # stop waiting and drop requests that have not started
+                raise Cancelled('Geocoding was cancelled after {} of {} places.'.format(done - 1, len(values)))
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(done, len(values))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return pd.Series(results, index=values.index, dtype=object)
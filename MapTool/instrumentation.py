@@ -0,0 +1,141 @@
+# -----------------------------------------------------------------------------------------
+# Name: instrumentation.py
+# Description: Records wall time, event counts (HTTP requests, cache hits, ...), rows and peak
+#              memory for each stage of a pipeline run, writes them as a JSON run report, and
+#              optionally profiles the run with cProfile and tracemalloc
+#------------------------------------------------------------------------------------------
+
+import io, os, sys, json, time, pstats, cProfile, threading, tracemalloc
+from contextlib import contextmanager
+
+counters = {}                               # number of times each event has happened in this process
+_lock = threading.Lock()
+
+def count(name, n = 1):                     # add n to event counter, safe to call from geocoding threads
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+def currentMemory():                        # return resident memory of process in bytes now, or None if it cannot be read
+    try:
+        import psutil                       # optional, works on every platform
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:     # Linux without psutil
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MemorySampler(object):                # reads resident memory on background thread and keeps highest value, since process peak never goes down between stages
+    def __init__(self, interval = 0.05):
+        self.interval = interval
+        self.peak = currentMemory()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        memory = currentMemory()
+        if memory is not None and (self.peak is None or memory > self.peak):
+            self.peak = memory
+
+    def start(self):
+        if self.peak is not None:           # memory can be read on this platform
+            self._thread.start()
+        return self
+
+    def stop(self):                         # return highest resident memory seen while sampling
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+        self._sample()
+        return self.peak
+
+def peakMemory():                           # return peak resident memory of process since it started in bytes, or None if it cannot be read
+    try:
+        import resource                     # not available on Windows
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024   # macOS reports bytes, Linux kilobytes
+    except ImportError:
+        pass
+    try:
+        import psutil                       # optional, reports peak working set on Windows
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+    except ImportError:
+        return None
+
+class RunRecorder(object):
+    def __init__(self, profile = False):    # profile runs cProfile and tracemalloc, which slows the run down
+        self.profile = profile
+        self.stages = []
+        self.started = time.time()
+        self.profiler = None
+        self.seconds = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self.profile:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.profiler = cProfile.Profile()   # only profiles the thread the run is on, not geocoding worker threads
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.profile and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.seconds = time.perf_counter() - self._start
+
+    @contextmanager
+    def stage(self, name):                  # record time, counter changes and memory of code run in with block, yield dictionary for extra values such as rows
+        record = {'name': name}
+        before = dict(counters)
+        if self.profile:
+            tracemalloc.reset_peak()
+        sampler = MemorySampler().start()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['counts'] = dict((key, value - before.get(key, 0)) for key, value in counters.items() if value != before.get(key, 0))
+            record['peakMemory'] = sampler.stop()  # highest resident memory sampled during stage
+            record['processPeakMemory'] = peakMemory()     # highest resident memory since process started
+            if self.profile:                # bytes allocated by Python at most during stage
+                record['peakTraced'] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+    def profileReport(self, limit = 30):    # return text of functions with most cumulative time
+        if self.profiler is None:
+            return ''
+        text = io.StringIO()
+        pstats.Stats(self.profiler, stream=text).sort_stats('cumulative').print_stats(limit)
+        return text.getvalue()
+
+    def report(self):                       # return dictionary of run and stage measurements
+        totals = {}
+        for stage in self.stages:
+            for key, value in stage['counts'].items():
+                totals[key] = totals.get(key, 0) + value
+        report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)), 'seconds': self.seconds, 'peakMemory': peakMemory(), 'counts': totals, 'stages': self.stages}
+        if self.profiler is not None:
+            report['profile'] = self.profileReport()
+        return report
+
+    def summary(self):                      # return one line summary of stage times and peak memory
+        text = ', '.join('{} {:.1f} s'.format(stage['name'], stage['seconds']) for stage in self.stages)
+        peak = peakMemory()
+        if peak:
+            text += '; process peak memory {:.0f} MB'.format(peak / 1048576.0)
+        return text
+
+    def write(self, path):                  # write JSON run report, and profile statistics next to it when profiling
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        if self.profiler is not None:
+            self.profiler.dump_stats(path.rsplit('.', 1)[0] + '.prof')   # open with pstats or snakeviz
@@ -0,0 +1,53 @@
+# -----------------------------------------------------------------------------------------
+# Name: lazy_imports.py
+# Description: Defers importing heavy packages (pandas, geopandas, shapely, folium, ...) until
+#              they are first used, and records how long each import took
+#------------------------------------------------------------------------------------------
+
+import sys, time, types, importlib, threading
+
+importTimes = {}                            # seconds taken to import each lazily imported module
+_lock = threading.RLock()
+
+class LazyModule(types.ModuleType):         # module placeholder that imports the real module on first attribute access
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self.__dict__['_module'] is None:
+            with _lock:
+                if self.__dict__['_module'] is None:
+                    name = self.__name__
+                    start = time.perf_counter()
+                    module = importlib.import_module(name)
+                    if name not in importTimes:
+                        importTimes[name] = time.perf_counter() - start
+                    self.__dict__['_module'] = module
+        return self.__dict__['_module']
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+def lazyImport(name):                       # return placeholder for module that is imported on first use
+    return LazyModule(name)
+
+def isImported(name):
+    return name in sys.modules
+
+def warmImports(names, callback = None):    # import modules on background thread so first use does not wait, then call callback
+    def warm():
+        for name in names:
+            LazyModule(name)._load()
+        if callback is not None:
+            callback()
+    thread = threading.Thread(target=warm, name='warm-imports', daemon=True)
+    thread.start()
+    return thread
+
+def importReport():                         # return text report of import times, slowest first
+    lines = ['{:<25}{:>8.3f} s'.format(name, seconds) for name, seconds in sorted(importTimes.items(), key=lambda item: -item[1])]
+    return '\n'.join(lines)
@@ -0,0 +1,101 @@
+# -----------------------------------------------------------------------------------------
+# Name: map_tool_batch.py
+# Description: Headless command-line entry point that runs the map tool pipeline from job
+#              spec files (JSON, or YAML if PyYAML is installed) without starting the GUI
+#
+# Job spec example:
+#   {"files": ["cities.csv"], "delimiter": "comma", "place": "City", "placeField": "city",
+#    "valueField": "population", "attributes": ["city", "population"],
+#    "outShapefile": "out/cities.shp", "outHtml": "out/cities.html"}
+#
+# Optional keys: "keys" (one key field per file when joining files), "state" (required for
+# County and Cities by County place types), "aggregate" ("sum", "mean" or "count" of city values
+# in each polygon for Cities by County and Cities by State place types). If "attributes" is
+# omitted, all fields of the files are kept.
+# "outShapefile" may be a list of paths to write several formats (.shp, .gpkg, .fgb, .parquet).
+#------------------------------------------------------------------------------------------
+
+import os, sys, json, glob, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import core_functions
+
+jobExtensions = ('.json', '.yaml', '.yml')
+
+def loadJob(path):                          # read job spec and resolve file paths relative to the spec file
+    with open(path) as f:
+        if path.endswith('.json'):
+            job = json.load(f)
+        else:
+            import yaml                     # only needed for YAML job specs
+            job = yaml.safe_load(f)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    resolve = lambda p: p if os.path.isabs(p) else os.path.join(folder, p)
+    job['files'] = [resolve(p) for p in job['files']]
+    if isinstance(job['outShapefile'], list):
+        job['outShapefile'] = [resolve(p) for p in job['outShapefile']]
+    else:
+        job['outShapefile'] = resolve(job['outShapefile'])
+    job['outHtml'] = resolve(job['outHtml'])
+    job.setdefault('delimiter', 'auto')
+    job.setdefault('keys', [])
+    job.setdefault('state', '')
+    job.setdefault('aggregate', None)
+    if 'attributes' not in job:            # keep all fields when no attribute fields are listed
+        fields = core_functions.getFields(core_functions.readHeaders(job['files'], job['delimiter']))
+        job['attributes'] = fields if len(job['files']) == 1 else fields[-1]
+    return job
+
+def runJob(path):                           # run one job spec and return (path, statistics, error message)
+    try:
+        job = loadJob(path)
+        outFiles = job['outShapefile'] if isinstance(job['outShapefile'], list) else [job['outShapefile']]
+        for output in outFiles + [job['outHtml']]:   # create output folders if needed
+            folder = os.path.dirname(output)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+        stats = core_functions.runPipeline(job['files'], job['delimiter'], job['keys'], job['place'], job['placeField'], job['valueField'], job['attributes'], job['state'], job['outShapefile'], job['outHtml'], aggregate=job['aggregate'])
+        return path, stats, None
+    except Exception as e:
+        return path, None, str(e.__class__) + ": " + str(e)
+
+def setRateLimit(rateLimit):                # run in each worker process, so workers together stay within the web service rate limit
+    core_functions.GEOCODE_RATE_LIMIT = rateLimit
+
+def findJobs(paths):                        # expand folders into the job spec files they contain
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            jobs.extend(sorted(p for p in glob.glob(os.path.join(path, '*')) if p.endswith(jobExtensions)))
+        else:
+            jobs.append(path)
+    return jobs
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Create shapefiles and web maps from job spec files without the GUI.')
+    parser.add_argument('jobs', nargs='+', help='job spec files or folders containing job spec files')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of jobs to run in parallel worker processes, which share the geocoding rate limit')
+    args = parser.parse_args(argv)
+
+    jobs = findJobs(args.jobs)
+    if not jobs:
+        parser.error('no job spec files found')
+
+    if args.workers > 1:                    # run jobs in separate processes, each with an equal share of the requests per second
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=setRateLimit, initargs=(core_functions.GEOCODE_RATE_LIMIT / float(args.workers) if core_functions.GEOCODE_RATE_LIMIT else 0,)) as executor:
+            results = list(executor.map(runJob, jobs))
+    else:
+        results = [runJob(job) for job in jobs]
+
+    failed = 0
+    for path, stats, error in results:
+        if error:
+            failed += 1
+            print('FAILED  {}: {}'.format(path, error))
+        else:
+            print('OK      {}: geocoded {} unique places for {} rows ({})'.format(path, stats['geometry']['unique'], stats['geometry']['rows'], stats['summary']))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
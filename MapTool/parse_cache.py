@@ -0,0 +1,87 @@
+# -----------------------------------------------------------------------------------------
+# Name: parse_cache.py
+# Description: Columnar (Parquet) cache of parsed text files so repeated loads of the same
+#              file read memory-mapped columns instead of parsing delimited text again
+#------------------------------------------------------------------------------------------
+
+import os, glob, json, hashlib, importlib.util
+from lazy_imports import lazyImport
+
+pa = lazyImport('pyarrow')
+pq = lazyImport('pyarrow.parquet')
+pyarrowInstalled = importlib.util.find_spec('pyarrow') is not None     # cache is only available when pyarrow is installed
+
+class ParseCache(object):
+    def __init__(self, folder, hashContent = False):    # hashContent also compares file contents, not only size and modification time
+        self.folder = folder
+        self.hashContent = hashContent
+        self.enabled = pyarrowInstalled
+        if self.enabled and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def paths(self, file, delimiter):       # return cache file name for current version of file and pattern matching all versions, pass to other methods so file is only hashed once
+        file = os.path.abspath(file)
+        info = os.stat(file)
+        key = [file, str(info.st_size), str(info.st_mtime_ns), delimiter]
+        if self.hashContent:
+            digest = hashlib.sha1()
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(1048576), b''):
+                    digest.update(block)
+            key.append(digest.hexdigest())
+        prefix = hashlib.sha1(file.encode('utf-8')).hexdigest()[:16]
+        version = hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.folder, prefix + '_' + version + '.parquet'), os.path.join(self.folder, prefix + '_*.parquet')
+
+    def storedColumns(self, file, delimiter, paths = None):     # return (cached fields, all fields of file) of cached parse of file, or (None, None) if not cached
+        if not self.enabled:
+            return None, None
+        path, _ = paths or self.paths(file, delimiter)
+        if not os.path.exists(path):
+            return None, None
+        schema = pq.read_schema(path)
+        header = (schema.metadata or {}).get(b'maptool_header')
+        if header is None:                  # saved before header was stored, parse file again
+            return None, None
+        return [name for name in schema.names if not name.startswith('__index_level_')], json.loads(header.decode('utf-8'))
+
+    def parsedSizes(self, file, delimiter, paths = None):    # return {field: (dtype, bytes)} of numeric fields as parsed, before they were downcast, or {} if not cached
+        path, _ = paths or self.paths(file, delimiter)
+        if not self.enabled or not os.path.exists(path):
+            return {}
+        sizes = (pq.read_schema(path).metadata or {}).get(b'maptool_parsed_sizes')
+        return dict((field, tuple(size)) for field, size in json.loads(sizes.decode('utf-8')).items()) if sizes is not None else {}
+
+    def load(self, file, delimiter, usecols = None, paths = None):     # return cached dataframe with fields of file in usecols (all fields if None), or None if some are not cached
+        paths = paths or self.paths(file, delimiter)
+        columns, header = self.storedColumns(file, delimiter, paths)
+        if columns is None:
+            return None
+        wanted = header if usecols is None else [field for field in header if field in set(usecols)]   # fields of other files in usecols are ignored
+        if not set(wanted).issubset(columns):
+            return None
+        return pq.read_table(paths[0], columns=wanted, memory_map=True).to_pandas()
+
+    def save(self, file, delimiter, df, header, paths = None, parsedSizes = None):     # save parsed dataframe, list of all fields of file and sizes of fields before downcasting, replacing cached versions of file that are out of date
+        if not self.enabled:
+            return
+        path, pattern = paths or self.paths(file, delimiter)
+        for stale in glob.glob(pattern):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:             # already removed by another worker process
+                    pass
+        temp = '{}.{}.tmp'.format(path, os.getpid())    # batch worker processes may save the same file at once
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata(dict(table.schema.metadata or {}, maptool_header=json.dumps(list(header)), maptool_parsed_sizes=json.dumps(parsedSizes or {})))
+            pq.write_table(table, temp)
+            os.replace(temp, path)          # replace atomically so a failed write never leaves a broken cache file
+        except (pa.ArrowException, OSError):    # fields that cannot be stored as Parquet are simply not cached
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def clear(self):                        # remove all cached files
+        for path in glob.glob(os.path.join(self.folder, '*.parquet')):
+            os.remove(path)
@@ -0,0 +1,115 @@
+# -----------------------------------------------------------------------------------------
+# Name: stub_server.py
+# Description: Local HTTP server that replays recorded Nominatim search and OSM polygon
+#              responses, so the geocoding code can be tested and benchmarked without
+#              network access. Set NOMINATIM_URL and OSM_POLYGON_URL in core_functions.py to
+#              http://127.0.0.1:<port>/search and http://127.0.0.1:<port>/get_geojson.py
+#
+# Recordings file example:
+#   {"/search?county=Lake&format=json&state=OH&...": [{"lat": "41.7", "lon": "-81.2", ...}],
+#    "/get_geojson.py?id=182157&params=0": {"type": "GeometryCollection", ...}}
+#
+# With --record UPSTREAM, requests that have no recording are forwarded to the real service
+# and their responses are added to the recordings file.
+#------------------------------------------------------------------------------------------
+
+import os, sys, json, time, argparse, threading, urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def makeKey(path):                          # return request path with query parameters sorted, so parameter order does not matter
+    parts = urllib.parse.urlsplit(path)
+    return parts.path + '?' + urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query)))
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'           # keep connections open so clients can reuse them
+    disable_nagle_algorithm = True          # headers and body are sent separately, don't hold body back waiting for an ack
+
+    def do_GET(self):
+        server = self.server
+        key = makeKey(self.path)
+        with server.lock:
+            body = server.recordings.get(key)
+        if body is None and server.upstream:   # fetch missing response from real service and record it
+            body = self.fetchUpstream(key)
+        if body is None:
+            body = server.default
+        if server.delay:                    # simulate latency of remote service
+            time.sleep(server.delay)
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with server.lock:
+            server.requests += 1
+
+    def fetchUpstream(self, key):
+        import requests                     # only needed when recording
+        r = requests.get(self.server.upstream.rstrip('/') + key, headers={'User-Agent': 'MapTool stub recorder'}, timeout=30)
+        if r.status_code != 200:
+            return None
+        with self.server.lock:
+            self.server.recordings[key] = r.text
+            self.server.save()
+        return r.text
+
+    def log_message(self, format, *args):   # only log requests when asked to
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port = 0, recordingsPath = None, default = '[]', delay = 0.0, upstream = None, verbose = False):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.recordingsPath = recordingsPath
+        self.recordings = {}
+        self.default = default              # response for requests without a recording, an empty Nominatim result by default
+        self.delay = delay
+        self.upstream = upstream
+        self.verbose = verbose
+        self.requests = 0
+        self.lock = threading.Lock()
+        if recordingsPath and os.path.exists(recordingsPath):
+            with open(recordingsPath, encoding='utf-8') as f:
+                for key, value in json.load(f).items():     # recordings may be stored as JSON values or as response text
+                    self.add(key, value)
+
+    def add(self, path, response):          # add recorded response for request path
+        self.recordings[makeKey(path)] = response if isinstance(response, str) else json.dumps(response)
+
+    def save(self):
+        if self.recordingsPath:
+            with open(self.recordingsPath, 'w', encoding='utf-8') as f:
+                json.dump(self.recordings, f, indent=1, sort_keys=True)
+
+    @property
+    def url(self):                          # base URL of server
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):                        # serve requests on background thread, return base URL
+        thread = threading.Thread(target=self.serve_forever, name='stub-server', daemon=True)
+        thread.start()
+        return self.url
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Replay recorded Nominatim and OSM polygon responses on a local port.')
+    parser.add_argument('recordings', nargs='?', help='JSON file of recorded responses keyed by request path')
+    parser.add_argument('-p', '--port', type=int, default=8089, help='port to listen on')
+    parser.add_argument('--default', default='[]', help='response for requests without a recording')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--record', metavar='UPSTREAM', help='forward unknown requests to this base URL and record the responses')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log each request')
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.port, args.recordings, args.default, args.delay, args.record, args.verbose)
+    print('Serving {} recorded responses on {}'.format(len(server.recordings), server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+# -----------------------------------------------------------------------------------------
+# Name: conftest.py
+# Description: Lets tests import the map tool modules, which import each other by module name
+#------------------------------------------------------------------------------------------
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
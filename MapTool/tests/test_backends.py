@@ -0,0 +1,48 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_backends.py
+# Description: Tests selecting geocoder backends by name and keeping cached responses of
+#              different services apart, offline with the gazetteer backend and stub server
+#------------------------------------------------------------------------------------------
+
+import pytest
+import pandas as pd
+
+import core_functions
+import stub_server
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    for name, value in [('GEOCODE_CACHE_PATH', str(tmp_path / 'geocode.sqlite')), ('BOUNDARY_STORE_PATH', None), ('PARSE_CACHE_DIR', None),
+                        ('FUZZY_MATCH', False), ('GEOCODE_RATE_LIMIT', 0), ('backend', None), ('geocodeCache', None), ('gazetteer', None)]:
+        monkeypatch.setattr(core_functions, name, value)
+    yield tmp_path
+    if core_functions.geocodeCache is not None:
+        core_functions.geocodeCache.close()
+
+def test_unknown_backend_is_an_error(settings, monkeypatch):
+    monkeypatch.setattr(core_functions, 'GEOCODER_BACKEND', 'nominatin')
+    with pytest.raises(ValueError, match='nominatin'):
+        core_functions.getBackend()
+
+def test_gazetteer_backend_geocodes_points_offline(settings, monkeypatch):
+    path = settings / 'places.txt'
+    path.write_text('USPS\tNAME\tINTPTLAT\tINTPTLONG\nMA\tBoston city\t42.3385\t-71.0184\n', encoding='utf-8')
+    monkeypatch.setattr(core_functions, 'GEOCODER_BACKEND', 'gazetteer')
+    monkeypatch.setattr(core_functions, 'GAZETTEER_FILES', [(str(path), 'City')])
+    geometry = core_functions.createGeometry(pd.DataFrame({'city': ['Boston', 'Boston, MA', 'Nowhere']}), 'City', 'city', '')
+    assert [(point.x, point.y) if point is not None else None for point in geometry] == [(-71.0184, 42.3385), (-71.0184, 42.3385), None]
+    assert core_functions.getGeocodeCache().stats()['entries'] == 0    # local lookups are not cached
+    assert core_functions.prefetchCounties(None, 'MA') == 0
+
+def test_cache_keeps_responses_of_each_service_apart(settings, monkeypatch):
+    monkeypatch.setattr(core_functions, 'GEOCODER_BACKEND', 'nominatim')
+    servers = [stub_server.StubServer(0), stub_server.StubServer(0)]
+    try:
+        for server, lon in zip(servers, (-71.0, -72.0)):    # two services answering the same query differently
+            server.add('/search?q=Boston&format=json&countrycodes=US&limit=1', [{'lat': '42.0', 'lon': str(lon)}])
+            monkeypatch.setattr(core_functions, 'NOMINATIM_URL', server.start() + '/search')
+            monkeypatch.setattr(core_functions, 'backend', None)
+            assert core_functions.geocodePoint('Boston').x == lon
+    finally:
+        for server in servers:
+            server.shutdown()
@@ -0,0 +1,52 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_boundary_store.py
+# Description: Tests that stored boundaries keep the place names they were saved with
+#------------------------------------------------------------------------------------------
+
+import json, sqlite3
+
+import pytest
+from shapely.geometry import box
+
+from boundary_store import BoundaryStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = BoundaryStore(str(tmp_path / 'boundaries.sqlite'))
+    yield store
+    store.close()
+
+def test_boundaries_return_names_as_saved(store):
+    store.putMany([(1, "St. Louis County", box(0, 0, 1, 1)), (2, "O'Brien County", box(1, 0, 2, 1))], 'County', 'MO')
+    store.addName(1, 'County', 'Saint Louis', 'MO')     # another spelling of a stored relation
+    boundaries = sorted(store.boundaries('County', 'MO'))
+    assert [(relationID, name, key) for relationID, name, key, _ in boundaries] == [(1, 'St. Louis County', 'saint louis'), (2, "O'Brien County", 'obrien')]
+    assert store.getByName('County', 'saint louis county', 'Missouri').equals(box(0, 0, 1, 1))
+
+def test_store_created_before_names_were_kept_is_upgraded(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE boundary_name (name_key TEXT PRIMARY KEY, relation_id INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE seed_file (path TEXT PRIMARY KEY, mtime REAL NOT NULL)')
+    conn.execute("INSERT INTO seed_file VALUES ('overpass:County:v2:MO', 1.0)")
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+    conn.close()
+    store = BoundaryStore(path)
+    try:
+        assert store.sourceTime('overpass:County:v2:MO') is None   # counties are fetched again to store their names
+        store.put(3, box(0, 0, 1, 1), 'County', 'Lake County', 'OH')
+        assert [name for _, name, _, _ in store.boundaries('County', 'OH')] == ['Lake County']
+    finally:
+        store.close()
+
+def test_seeding_saves_all_features_in_one_transaction(store, tmp_path):
+    features = [{'type': 'Feature', 'properties': {'name': 'County {}'.format(i), 'state': 'OH' if i % 2 else 'MI'}, 'geometry': box(i, 0, i + 1, 1).__geo_interface__} for i in range(200)]
+    path = tmp_path / 'counties.geojson'
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': features}), encoding='utf-8')
+    statements = []
+    store._conn.set_trace_callback(statements.append)
+    assert store.seedFromGeoJSON(str(path), 'County') == 200
+    assert statements.count('COMMIT') == 1
+    assert len(store.boundaries('County', 'OH')) == 100 and store.getByName('County', 'County 4', 'MI').equals(box(4, 0, 5, 1))
+    assert store.seedFromGeoJSON(str(path), 'County') == 0     # unchanged file is not loaded again
@@ -0,0 +1,39 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_compact.py
+# Description: Tests that memory saved by compacting loaded tables is reported against the
+#              dtypes fields were parsed as, including fields downcast while reading
+#------------------------------------------------------------------------------------------
+
+import pytest
+
+import core_functions
+import parse_cache
+
+@pytest.fixture
+def dataFile(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_functions, 'PARSE_CACHE_DIR', None)
+    monkeypatch.setattr(core_functions, 'parseCache', None)
+    path = tmp_path / 'data.csv'
+    path.write_text('key,value,label\n' + ''.join('{},{},class{}\n'.format(i, i % 100, i % 4) for i in range(1000)), encoding='utf-8')
+    return str(path)
+
+def compactFields(dataFile):                # load file and compact it as runPipeline does, return field statistics by name
+    parsedSizes = []
+    df = core_functions.createDF([dataFile], 'comma', ['key', 'value', 'label'], parsedSizes=parsedSizes)[0]
+    assert str(df['value'].dtype) == 'int8'     # numeric fields are downcast while reading
+    stats = {}
+    core_functions.compactDataFrame(df, 0.5, exclude=['key'], stats=stats, parsedSizes=parsedSizes[0])
+    return dict((item['field'], item) for item in stats['fields']), stats
+
+def test_numeric_savings_are_reported_against_parsed_dtype(dataFile):
+    fields, stats = compactFields(dataFile)
+    assert (fields['value']['dtypeBefore'], fields['value']['bytesBefore']) == ('int64', 8000)
+    assert (fields['value']['dtypeAfter'], fields['value']['bytesAfter']) == ('int8', 1000)
+    assert fields['label']['dtypeAfter'] == 'category' and fields['label']['bytesAfter'] < fields['label']['bytesBefore']
+    assert stats['bytesBefore'] == sum(item['bytesBefore'] for item in fields.values())
+
+@pytest.mark.skipif(not parse_cache.pyarrowInstalled, reason='parse cache requires pyarrow')
+def test_parsed_dtypes_are_kept_in_parse_cache(dataFile, tmp_path, monkeypatch):
+    monkeypatch.setattr(core_functions, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    parsed, cached = compactFields(dataFile)[0], compactFields(dataFile)[0]    # second load is read from cache
+    assert cached['value'] == parsed['value']
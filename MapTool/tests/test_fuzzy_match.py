@@ -0,0 +1,47 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_fuzzy_match.py
+# Description: Tests the vectorized edit distance against a plain Levenshtein implementation,
+#              and trigram blocking and similarity threshold of fuzzy name matching
+#------------------------------------------------------------------------------------------
+
+import random
+
+import numpy as np
+
+from fuzzy_match import FuzzyIndex, editDistance
+from gazetteer import normalizeName
+
+def levenshtein(a, b):                      # reference edit distance, one row of the table at a time
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+def test_edit_distance_matches_reference():
+    generator = random.Random(0)
+    alphabet = 'abcde xyz'                  # small alphabet so pairs share characters
+    a = [''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 12))) for _ in range(3000)]
+    b = [''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 12))) for _ in range(3000)]
+    b[:len(a) // 10] = a[:len(a) // 10]     # include identical pairs
+    assert editDistance(a, b).tolist() == [levenshtein(x, y) for x, y in zip(a, b)]
+
+def test_edit_distance_of_unicode_names():
+    a, b = ['españa', 'köln', 'são paulo'], ['espana', 'koln', 'sao paulo']
+    assert editDistance(a, b).tolist() == [1, 1, 1]
+
+def test_misspelled_name_matches_among_many_candidates():
+    generator = random.Random(1)
+    names = [''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(generator.randint(4, 10))) for _ in range(5000)]
+    names += ['boston', 'austin', 'houston', 'bristol']
+    report = FuzzyIndex(names).match([normalizeName('Bostn')], threshold=0.8)
+    assert report['match'].tolist() == ['boston'] and bool(report['matched'][0])
+    assert np.isclose(report['score'][0], 1.0 - 1.0 / 6)
+
+def test_no_match_below_threshold():
+    index = FuzzyIndex(['boston', 'austin', 'houston', 'bristol'])
+    report = index.match(['bostn', 'bxstxn', 'zzzz'], threshold=0.85)  # "bostn" scores 0.83 against "boston"
+    assert report['match'].tolist() == [None, None, None]
+    assert not report['matched'].any()
@@ -0,0 +1,33 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_gazetteer.py
+# Description: Tests offline gazetteer lookups against a file in U.S. Census Gazetteer layout
+#------------------------------------------------------------------------------------------
+
+import pytest
+
+from gazetteer import Gazetteer
+
+censusRows = [('NJ', 'Jersey City city', 40.7114, -74.0648), ('UT', 'Salt Lake City city', 40.7777, -111.9306), ('WV', 'Charles Town city', 39.2838, -77.8560),
+              ('MO', 'Kansas City city', 39.1238, -94.5541), ('KS', 'Kansas City city', 39.1235, -94.7443), ('OK', 'Oklahoma City city', 35.4671, -97.5137),
+              ('MA', 'Boston city', 42.3385, -71.0184), ('NY', 'New York city', 40.6635, -73.9387), ('NJ', 'Jersey village', 40.0, -75.0)]
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    path = tmp_path / '2020_Gaz_place_national.txt'
+    lines = ['USPS\tGEOID\tANSICODE\tNAME\tLSAD\tFUNCSTAT\tALAND\tAWATER\tALAND_SQMI\tAWATER_SQMI\tINTPTLAT\tINTPTLONG                                                                                                               ']
+    for i, (state, name, lat, lon) in enumerate(censusRows):
+        lines.append('\t'.join([state, str(i), str(i), name, '25', 'A', '0', '0', '0', '0', str(lat), str(lon)]))
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    gazetteer = Gazetteer()
+    assert gazetteer.load(str(path), 'City') == len(censusRows)
+    return gazetteer
+
+@pytest.mark.parametrize('name, expected', [('Jersey City', (-74.0648, 40.7114)), ('Salt Lake City', (-111.9306, 40.7777)), ('Charles Town', (-77.8560, 39.2838)),
+                                            ('Kansas City, MO', (-94.5541, 39.1238)), ('Kansas City, KS', (-94.7443, 39.1235)), ('Oklahoma City', (-97.5137, 35.4671)),
+                                            ('Boston', (-71.0184, 42.3385)), ('New York', (-73.9387, 40.6635)), ('Jersey City city', (-74.0648, 40.7114))])
+def test_lookup_keeps_type_word_that_is_part_of_name(gazetteer, name, expected):
+    assert gazetteer.lookup('City', name) == expected
+
+def test_lookup_does_not_confuse_stripped_names(gazetteer):
+    assert gazetteer.lookup('City', 'Jersey') == (-75.0, 40.0)     # "Jersey village", not Jersey City
+    assert gazetteer.lookup('City', 'Springfield') is None
@@ -0,0 +1,72 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_parse_cache.py
+# Description: Tests that createDF only parses fields missing from the parse cache and only
+#              hashes each file once when file contents are compared
+#------------------------------------------------------------------------------------------
+
+import pytest
+
+import core_functions
+import parse_cache
+
+pytestmark = pytest.mark.skipif(not parse_cache.pyarrowInstalled, reason='parse cache requires pyarrow')
+
+@pytest.fixture
+def dataFile(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_functions, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(core_functions, 'PARSE_CACHE_HASH', True)
+    monkeypatch.setattr(core_functions, 'parseCache', None)
+    path = tmp_path / 'data.csv'
+    path.write_text('key,city,value,extra\n' + ''.join('{},Place{},{},{}\n'.format(i, i % 7, i * 3, i % 2) for i in range(50)), encoding='utf-8')
+    return str(path)
+
+def test_partial_hit_parses_only_missing_fields(dataFile, monkeypatch):
+    parsed = []
+    readTextFile = core_functions.readTextFile
+    def recordingRead(file, delimiter, usecols = None, *args):
+        parsed.append(usecols)
+        return readTextFile(file, delimiter, usecols, *args)
+    monkeypatch.setattr(core_functions, 'readTextFile', recordingRead)
+
+    first = core_functions.createDF([dataFile], 'comma', ['key', 'city'])[0]
+    second = core_functions.createDF([dataFile], 'comma', ['key', 'value'])[0]
+    third = core_functions.createDF([dataFile], 'comma', ['city', 'value', 'key'])[0]
+    assert parsed == [['key', 'city'], ['value']]     # third call is read from cache only
+    assert list(first.columns) == ['key', 'city'] and list(second.columns) == ['key', 'value']
+    assert sorted(third.columns) == ['city', 'key', 'value']
+    assert third['value'].tolist() == [i * 3 for i in range(50)] and third['city'].astype(str).tolist() == ['Place{}'.format(i % 7) for i in range(50)]
+
+def test_file_is_hashed_once_per_load(dataFile, monkeypatch):
+    calls = []
+    paths = parse_cache.ParseCache.paths
+    def countingPaths(self, file, delimiter):
+        calls.append(file)
+        return paths(self, file, delimiter)
+    monkeypatch.setattr(parse_cache.ParseCache, 'paths', countingPaths)
+
+    core_functions.createDF([dataFile], 'comma', ['key'])
+    core_functions.createDF([dataFile], 'comma', ['key', 'value'])
+    core_functions.createDF([dataFile], 'comma')
+    assert len(calls) == 3
+
+def test_fields_of_other_files_do_not_stop_cache_hits(dataFile, tmp_path, monkeypatch):
+    second = tmp_path / 'attributes.csv'
+    second.write_text('key,label\n' + ''.join('{},class{}\n'.format(i, i % 3) for i in range(50)), encoding='utf-8')
+    parsed, saved = [], []
+    readTextFile, save = core_functions.readTextFile, parse_cache.ParseCache.save
+    def recordingRead(file, delimiter, usecols = None, *args):
+        parsed.append(file)
+        return readTextFile(file, delimiter, usecols, *args)
+    def recordingSave(self, file, *args, **kwargs):
+        saved.append(file)
+        return save(self, file, *args, **kwargs)
+    monkeypatch.setattr(core_functions, 'readTextFile', recordingRead)
+    monkeypatch.setattr(parse_cache.ParseCache, 'save', recordingSave)
+
+    usecols = ['value', 'label', 'key', 'key']   # attributes and join keys of both files, as runPipeline passes them
+    for run in range(3):
+        first, attributes = core_functions.createDF([dataFile, str(second)], 'comma', usecols)
+        assert list(first.columns) == ['key', 'value'] and list(attributes.columns) == ['key', 'label']
+        assert attributes['label'].astype(str).tolist() == ['class{}'.format(i % 3) for i in range(50)]
+    assert parsed == [dataFile, str(second)]     # parsed on first run only, later runs read cache
+    assert saved == [dataFile, str(second)]      # unchanged cache files are not written again
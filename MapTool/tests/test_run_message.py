@@ -0,0 +1,28 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_run_message.py
+# Description: Runs the pipeline offline with the gazetteer backend and checks the status bar
+#              message shown when a run succeeds
+#------------------------------------------------------------------------------------------
+
+import pytest
+
+import core_functions
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    gazetteerPath = tmp_path / 'places.txt'
+    gazetteerPath.write_text('USPS\tNAME\tINTPTLAT\tINTPTLONG\nMA\tBoston city\t42.3385\t-71.0184\nMA\tSalem city\t42.5140\t-70.9020\n', encoding='utf-8')
+    for name, value in [('GEOCODER_BACKEND', 'gazetteer'), ('GAZETTEER_FILES', [(str(gazetteerPath), 'City')]), ('GEOCODE_CACHE_PATH', None), ('BOUNDARY_STORE_PATH', None),
+                        ('PARSE_CACHE_DIR', None), ('FUZZY_MATCH', False), ('STAGE_CACHE', False), ('RUN_REPORT', False), ('backend', None), ('gazetteer', None)]:
+        monkeypatch.setattr(core_functions, name, value)
+    return tmp_path
+
+def test_message_names_output_written_without_spatial_index(offline):
+    data = offline / 'data.csv'
+    data.write_text('city,value\nBoston,1\nSalem,2\nNowhere,3\n', encoding='utf-8')
+    output = str(offline / 'out.fgb')
+    stats = core_functions.runPipeline([str(data)], 'comma', [], 'City', 'city', 'value', ['city', 'value'], '', output, str(offline / 'map.html'))
+    assert 'note' in stats['write'][0]      # un-geocoded row stops FlatGeobuf spatial index
+    message = core_functions.runMessage(stats)
+    assert message.startswith('Success!')
+    assert 'out.fgb written without spatial index because 1 rows have no geometry.' in message
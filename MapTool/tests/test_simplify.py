@@ -0,0 +1,30 @@
+# -----------------------------------------------------------------------------------------
+# Name: test_simplify.py
+# Description: Tests that map polygons are simplified when merged rows repeat a place, and when
+#              polygons overlap so they are not a valid coverage
+#------------------------------------------------------------------------------------------
+
+import geopandas as gpd
+import shapely
+from shapely.geometry import Point
+
+import core_functions
+
+def test_repeated_rows_are_simplified():
+    county = Point(0, 0).buffer(1.0, quad_segs=64)  # 257 vertices
+    other = Point(3, 0).buffer(1.0, quad_segs=64)
+    gdf = gpd.GeoDataFrame({'name': ['a', 'a', 'a', 'b', 'none']}, geometry=[county, county, county, other, None], crs='epsg:4326')
+    stats = {}
+    result = core_functions.simplifyForMap(gdf, 6, stats)
+    vertices = shapely.get_num_coordinates(result.geometry.values)
+    assert vertices[0] == vertices[1] == vertices[2] < 100 and vertices[3] < 100
+    assert result.geometry.iloc[0] is result.geometry.iloc[1]     # repeated rows share one simplified polygon
+    assert result.geometry.iloc[4] is None
+    assert stats['verticesBefore'] == 2 * 257 and stats['verticesAfter'] == vertices[0] + vertices[3]
+
+def test_overlapping_polygons_are_simplified_each_on_its_own():
+    first = Point(0, 0).buffer(1.0, quad_segs=64)
+    second = Point(0.5, 0).buffer(1.0, quad_segs=64)    # overlaps first, not a valid coverage
+    result = core_functions.simplifyForMap(gpd.GeoDataFrame({'name': ['a', 'b']}, geometry=[first, second], crs='epsg:4326'), 6)
+    assert (shapely.get_num_coordinates(result.geometry.values) < 100).all()
+    assert result.geometry.is_valid.all()
@@ -0,0 +1,174 @@
+# -----------------------------------------------------------------------------------------
+# Name: tiled_map.py
+# Description: Writes very large layers as per-tile GeoJSON script files next to a small
+#              Leaflet viewer that only loads the tiles in view, instead of one HTML file
+#              with every feature embedded
+#------------------------------------------------------------------------------------------
+
+import os, json, math, shutil
+from lazy_imports import lazyImport
+
+np = lazyImport('numpy')
+pd = lazyImport('pandas')
+shapely = lazyImport('shapely')
+
+colors = ['#edf8fb', '#ccece6', '#99d8c9', '#66c2a4', '#2ca25f', '#006d2c']   # ColorBrewer BuGn classes, same scheme as choropleth maps
+maxLatitude = 85.0511287798                 # latitude limit of web mercator tiles
+
+def tileX(lon, zoom):                       # web mercator tile column of longitudes
+    n = 2 ** zoom
+    return np.clip(np.floor((np.asarray(lon) + 180.0) / 360.0 * n), 0, n - 1).astype(np.int64)
+
+def tileY(lat, zoom):                       # web mercator tile row of latitudes
+    n = 2 ** zoom
+    lat = np.radians(np.clip(np.asarray(lat), -maxLatitude, maxLatitude))
+    return np.clip(np.floor((1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * n), 0, n - 1).astype(np.int64)
+
+def assignTiles(bounds, zoom):              # return (feature index, tile x, tile y) for every tile each feature's bounding box touches
+    x0, x1 = tileX(bounds[:, 0], zoom), tileX(bounds[:, 2], zoom)
+    y0, y1 = tileY(bounds[:, 3], zoom), tileY(bounds[:, 1], zoom)   # tile rows count down from north
+    width = x1 - x0 + 1
+    counts = width * (y1 - y0 + 1)
+    feature = np.repeat(np.arange(len(bounds)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return feature, x0[feature] + offset % width[feature], y0[feature] + offset // width[feature]
+
+def classify(values):                       # return fill color for each value using quantile classes, and class breaks for legend
+    numbers = pd.to_numeric(pd.Series(values), errors='coerce').values.astype(float)
+    fills = np.full(len(numbers), '#cccccc', dtype=object)     # values that are not numbers are drawn grey
+    valid = ~np.isnan(numbers)
+    if not valid.any():
+        return fills, []
+    breaks = np.unique(np.quantile(numbers[valid], np.linspace(0, 1, len(colors) + 1)))
+    classes = np.clip(np.searchsorted(breaks, numbers[valid], side='right') - 1, 0, len(colors) - 1)
+    fills[valid] = np.array(colors, dtype=object)[classes]
+    return fills, breaks.tolist()
+
+def writeTiledMap(gdf, id_field, value_field, outHtml, startZoom, minZoom = 3, maxZoom = 8, maxFeaturesPerTile = 500, simplify = None):   # write tile folder and viewer html, return statistics
+    gdf = gdf[gdf.geometry.notna()]
+    isPoint = bool(len(gdf) and (gdf.geom_type == 'Point').all())
+    tileFolder = os.path.splitext(outHtml)[0] + '_tiles'
+    if os.path.isdir(tileFolder):           # remove tiles of earlier run
+        shutil.rmtree(tileFolder)
+
+    # build feature properties once: id, popup fields and fill color
+    fills, breaks = classify(gdf[value_field].values)
+    properties = [json.dumps({'_id': i, 'name': str(name), 'value': str(value), 'fill': fill}) for i, (name, value, fill) in enumerate(zip(gdf[id_field].tolist(), gdf[value_field].tolist(), fills.tolist()))]
+
+    tiles = []
+    for zoom in range(minZoom, maxZoom + 1):
+        layer = gdf if simplify is None or isPoint else simplify(gdf, zoom)   # polygons are simplified for each zoom level
+        geometry = layer.geometry.values
+        features = ['{"type":"Feature","properties":' + p + ',"geometry":' + g + '}' for p, g in zip(properties, shapely.to_geojson(np.asarray(geometry, dtype=object)).tolist())]
+        feature, x, y = assignTiles(shapely.bounds(np.asarray(geometry, dtype=object)), zoom)
+
+        # group features by tile, keeping at most maxFeaturesPerTile points per tile below the most detailed zoom level
+        order = np.lexsort((feature, y, x))
+        feature, x, y = feature[order], x[order], y[order]
+        starts = np.flatnonzero(np.r_[True, (x[1:] != x[:-1]) | (y[1:] != y[:-1])])
+        ends = np.r_[starts[1:], len(feature)]
+        for start, end in zip(starts, ends):
+            if isPoint and zoom < maxZoom:
+                end = min(end, start + maxFeaturesPerTile)
+            key = '{}/{}/{}'.format(zoom, x[start], y[start])
+            folder = os.path.join(tileFolder, str(zoom), str(x[start]))
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(os.path.join(folder, '{}.js'.format(y[start])), 'w', encoding='utf-8') as f:  # script files load from local folders, unlike fetch
+                f.write('mapToolTile("' + key + '",{"type":"FeatureCollection","features":[' + ','.join(features[i] for i in feature[start:end]) + ']});')
+            tiles.append(key)
+
+    minx, miny, maxx, maxy = gdf.total_bounds if len(gdf) else (-98.6, 39.8, -98.6, 39.8)
+    config = {'tileFolder': os.path.basename(tileFolder), 'tiles': tiles, 'minZoom': minZoom, 'maxZoom': maxZoom, 'center': [(miny + maxy) / 2.0, (minx + maxx) / 2.0], 'zoom': startZoom, 'isPoint': isPoint, 'valueField': str(value_field), 'colors': colors, 'breaks': breaks}
+    with open(outHtml, 'w', encoding='utf-8') as f:
+        f.write(viewerTemplate.replace('{{CONFIG}}', json.dumps(config)))
+    return {'tiles': len(tiles), 'features': len(gdf), 'tileFolder': tileFolder}
+
+viewerTemplate = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Map</title>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+.legend { background: white; padding: 6px 8px; font: 12px sans-serif; line-height: 18px; }
+.legend i { width: 18px; height: 18px; float: left; margin-right: 6px; opacity: 0.7; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var config = {{CONFIG}};
+var map = L.map('map', {preferCanvas: true}).setView(config.center, config.zoom);
+L.tileLayer('https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png', {attribution: '&copy; OpenStreetMap contributors &copy; CARTO'}).addTo(map);
+
+var available = {};                         // tiles that exist, so empty tiles are never requested
+config.tiles.forEach(function (key) { available[key] = true; });
+var layer = null, layerZoom = null, shown = {}, requested = {};
+
+function escape(text) { return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;'); }
+
+function resetLayer(zoom) {                 // drop features of previous zoom level so memory stays bounded
+    if (layer) { map.removeLayer(layer); }
+    layer = L.geoJSON(null, {
+        style: function (f) { return {fillColor: f.properties.fill, fillOpacity: 0.7, color: '#000', weight: 1, opacity: 0.2}; },
+        pointToLayer: function (f, latlng) { return L.circleMarker(latlng, {radius: 5}); },
+        onEachFeature: function (f, l) { l.bindPopup(function () { return '<strong>' + escape(f.properties.name) + '</strong><br>' + escape(config.valueField) + ': <strong>' + escape(f.properties.value) + '</strong>'; }); }
+    }).addTo(map);
+    layerZoom = zoom; shown = {}; requested = {};
+}
+
+window.mapToolTile = function (key, data) {    // called by each tile script when it has loaded
+    if (Number(key.split('/')[0]) !== layerZoom) { return; }
+    data.features = data.features.filter(function (f) {   // features crossing tile edges are in several tiles, only draw them once
+        if (shown[f.properties._id]) { return false; }
+        shown[f.properties._id] = true;
+        return true;
+    });
+    layer.addData(data);
+};
+
+function tileX(lon, z) { return Math.floor((lon + 180) / 360 * Math.pow(2, z)); }
+function tileY(lat, z) {
+    lat = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+    return Math.floor((1 - Math.log(Math.tan(lat) + 1 / Math.cos(lat)) / Math.PI) / 2 * Math.pow(2, z));
+}
+
+function update() {                         // load tiles in view at closest tile zoom level
+    var z = Math.max(config.minZoom, Math.min(config.maxZoom, map.getZoom()));
+    if (z !== layerZoom) { resetLayer(z); }
+    var b = map.getBounds();
+    for (var x = tileX(b.getWest(), z); x <= tileX(b.getEast(), z); x++) {
+        for (var y = tileY(b.getNorth(), z); y <= tileY(b.getSouth(), z); y++) {
+            var key = z + '/' + x + '/' + y;
+            if (available[key] && !requested[key]) {
+                requested[key] = true;
+                var script = document.createElement('script');
+                script.src = config.tileFolder + '/' + key + '.js';
+                document.body.appendChild(script);
+            }
+        }
+    }
+}
+
+if (!config.isPoint && config.breaks.length) {  // legend of value classes
+    var legend = L.control({position: 'bottomright'});
+    legend.onAdd = function () {
+        var div = L.DomUtil.create('div', 'legend'), html = '<strong>' + escape(config.valueField) + '</strong><br>';
+        for (var i = 0; i < config.breaks.length - 1; i++) {
+            html += '<i style="background:' + config.colors[i] + '"></i>' + config.breaks[i] + ' &ndash; ' + config.breaks[i + 1] + '<br>';
+        }
+        div.innerHTML = html;
+        return div;
+    };
+    legend.addTo(map);
+}
+
+map.on('moveend', update);
+update();
+</script>
+</body>
+</html>
+'''